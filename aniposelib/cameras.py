@@ -1,39 +1,118 @@
 import cv2
 import numpy as np
 from copy import copy
-from scipy.sparse import lil_matrix, dok_matrix
+from functools import lru_cache
+from scipy.sparse import csr_matrix, vstack as sparse_vstack
 from scipy.linalg import inv
 from scipy import optimize
-from scipy import signal
-from numba import jit
+from scipy.ndimage import median_filter
+from numpy.lib.stride_tricks import sliding_window_view
+from numba import njit, prange
 from collections import defaultdict, Counter
 import toml
 import itertools
-from tqdm import trange
+from tqdm import tqdm, trange
 from pprint import pprint
 import time
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 from .boards import merge_rows, extract_points, extract_rtvecs, get_video_params
 from .utils import get_initial_extrinsics, make_M, get_rtvec, get_connections
 
 
-@jit(nopython=True, parallel=True)
+@njit(cache=True)
+def smallest_eigvec_sym4(M):
+    """
+    Eigenvector of the smallest eigenvalue of a symmetric positive semi-definite 4x4 matrix.
+
+    For the normal matrix of a triangulation the smallest eigenvalue is close to zero
+    and well separated from the others, so inverse iteration converges in a couple of
+    steps. Each step solves with an LDLᵀ factorization of M + σI whose loops have fixed
+    trip counts, so the compiler unrolls them and no LAPACK call is needed. The tiny
+    shift σ keeps the factorization defined when M is singular. Falls back to
+    np.linalg.eigh if the factorization breaks down or the iteration does not converge.
+    """
+    shift = 1e-12 * (M[0, 0] + M[1, 1] + M[2, 2] + M[3, 3])
+
+    # LDLᵀ factorization of M + shift * I
+    L = np.eye(4)
+    D = np.empty(4)
+    for j in range(4):
+        d = M[j, j] + shift
+        for k in range(j):
+            d -= L[j, k] * L[j, k] * D[k]
+        if not d > 0:
+            return np.linalg.eigh(M)[1][:, 0]
+        D[j] = d
+        for i in range(j + 1, 4):
+            s = M[i, j]
+            for k in range(j):
+                s -= L[i, k] * L[j, k] * D[k]
+            L[i, j] = s / d
+
+    # the homogeneous coordinate of a finite point is non-zero,
+    # so e4 always has a component along the solution
+    v = np.zeros(4)
+    v[3] = 1.0
+    x = np.empty(4)
+    for _ in range(8):
+        # solve (M + shift * I) x = v as L D Lᵀ x = v
+        for i in range(4):
+            s = v[i]
+            for k in range(i):
+                s -= L[i, k] * x[k]
+            x[i] = s
+        for i in range(4):
+            x[i] /= D[i]
+        for i in range(3, -1, -1):
+            s = x[i]
+            for k in range(i + 1, 4):
+                s -= L[k, i] * x[k]
+            x[i] = s
+
+        norm = np.sqrt(x[0] ** 2 + x[1] ** 2 + x[2] ** 2 + x[3] ** 2)
+        diff = 0.0
+        for i in range(4):
+            x[i] /= norm
+            diff = max(diff, abs(x[i] - v[i]))
+            v[i] = x[i]
+        if diff < 1e-12:
+            return v
+
+    return np.linalg.eigh(M)[1][:, 0]
+
+
+@njit(cache=True, fastmath=True)
+def _add_dlt_rows(M, x, y, mat, w):
+    """Add the outer products of the two weighted DLT rows of one view,
+    w * (x * mat[2] - mat[0]) and w * (y * mat[2] - mat[1]), to the 4x4 matrix M,
+    so that AᵀA is formed without ever allocating A"""
+    w2 = w * w
+    for a in range(4):
+        ra = x * mat[2, a] - mat[0, a]
+        sa = y * mat[2, a] - mat[1, a]
+        for b in range(4):
+            rb = x * mat[2, b] - mat[0, b]
+            sb = y * mat[2, b] - mat[1, b]
+            M[a, b] += w2 * (ra * rb + sa * sb)
+
+
+@njit(cache=True, fastmath=True)
 def triangulate_simple(points, camera_mats):
     num_cams = len(camera_mats)
-    A = np.zeros((num_cams * 2, 4))
+    # the last right-singular vector of A is the eigenvector of AᵀA
+    # with the smallest eigenvalue, which avoids computing U in a full SVD
+    M = np.zeros((4, 4))
     for i in range(num_cams):
         x, y = points[i]
-        mat = camera_mats[i]
-        A[(i * 2) : (i * 2 + 1)] = x * mat[2] - mat[0]
-        A[(i * 2 + 1) : (i * 2 + 2)] = y * mat[2] - mat[1]
-    u, s, vh = np.linalg.svd(A, full_matrices=True)
-    p3d = vh[-1]
+        _add_dlt_rows(M, x, y, camera_mats[i], 1.0)
+    p3d = smallest_eigvec_sym4(M)
     p3d = p3d[:3] / p3d[3]
     return p3d
 
 
-
-@jit(nopython=True, parallel=True)
+@njit(cache=True, fastmath=True)
 def triangulate_weighted(points, camera_mats, weights):
     """
     Reconstruct a 3D point from its weighted 2D projections using linear triangulation.
@@ -42,9 +121,9 @@ def triangulate_weighted(points, camera_mats, weights):
         x * P[2, :] - P[0, :] = 0
         y * P[2, :] - P[1, :] = 0
     These equations are scaled by a confidence weight (0 to 1) for each observation before stacking them
-    into a matrix A. The 3D point in homogeneous coordinates is found via SVD, where the solution corresponds
-    to the singular vector associated with the smallest singular value. Finally, the homogeneous coordinate is
-    converted to a Euclidean point.
+    into a matrix A. The 3D point in homogeneous coordinates is the right-singular vector of A associated
+    with the smallest singular value, which is found as the eigenvector of the 4x4 matrix AᵀA with the
+    smallest eigenvalue. Finally, the homogeneous coordinate is converted to a Euclidean point.
 
     Parameters
     ----------
@@ -61,30 +140,131 @@ def triangulate_weighted(points, camera_mats, weights):
         The reconstructed 3D point in Euclidean coordinates.
     """
     num_cams = len(camera_mats)
-    # Allocate matrix A with 2 equations per camera view.
-    A = np.zeros((num_cams * 2, 4))
+    # Accumulate the weighted normal matrix AᵀA view by view, so A itself is never allocated.
+    M = np.zeros((4, 4))
     for i in range(num_cams):
         # Extract the 2D point (x, y) for the current camera view.
         x, y = points[i]
-        # Get the current camera's projection matrix (3x4).
-        mat = camera_mats[i]
-        # Get the confidence weight for this observation.
-        w = weights[i]
-        # For the i-th camera, construct two equations scaled by the weight.
-        # Equation from the x-coordinate:
-        A[i * 2, :] = w * (x * mat[2, :] - mat[0, :])
-        # Equation from the y-coordinate:
-        A[i * 2 + 1, :] = w * (y * mat[2, :] - mat[1, :])
-
-    # Compute the SVD of the weighted matrix A.
-    u, s, vh = np.linalg.svd(A, full_matrices=True)
-    # The solution is the singular vector corresponding to the smallest singular value.
-    p3d_homogeneous = vh[-1]
+        # Add the two equations of this view, scaled by its confidence weight:
+        # x * P[2, :] - P[0, :] and y * P[2, :] - P[1, :]
+        _add_dlt_rows(M, x, y, camera_mats[i], weights[i])
+
+    # The solution is the eigenvector corresponding to the smallest eigenvalue.
+    p3d_homogeneous = smallest_eigvec_sym4(M)
     # Convert the homogeneous 4-vector into a Euclidean 3D point.
     p3d = p3d_homogeneous[:3] / p3d_homogeneous[3]
     return p3d
 
 
+@njit(parallel=True, cache=True)
+def _triangulate_pairs(points, camera_mats, pairs, out):
+    """Triangulate the CxNx2 points of every camera pair (j1, j2) in the Px2 pairs
+    with the midpoint method, writing to the PxNx3 out the midpoint of the closest
+    approach of the two rays. camera_mats are the Cx3x4 extrinsics [R|t] of the
+    cameras, points are normalized image coordinates. Points missing in either view
+    or with parallel rays are NaN. All pairs and points are solved in one parallel
+    loop, with scalar arithmetic only so nothing is allocated per point."""
+    n_cams = camera_mats.shape[0]
+    n_points = points.shape[1]
+    # ray origins, the camera centers -Rᵀt
+    centers = np.zeros((n_cams, 3))
+    for j in range(n_cams):
+        for k in range(3):
+            for r in range(3):
+                centers[j, k] -= camera_mats[j, r, k] * camera_mats[j, r, 3]
+
+    for ix in prange(pairs.shape[0] * n_points):
+        pair = ix // n_points
+        i = ix - pair * n_points
+        j1, j2 = pairs[pair, 0], pairs[pair, 1]
+        x1, y1 = points[j1, i, 0], points[j1, i, 1]
+        x2, y2 = points[j2, i, 0], points[j2, i, 1]
+
+        # ray directions Rᵀ [x, y, 1], only through their dot products
+        a = b = c = d = e = 0.0
+        for k in range(3):
+            d1 = camera_mats[j1, 0, k] * x1 + camera_mats[j1, 1, k] * y1 + camera_mats[j1, 2, k]
+            d2 = camera_mats[j2, 0, k] * x2 + camera_mats[j2, 1, k] * y2 + camera_mats[j2, 2, k]
+            w = centers[j1, k] - centers[j2, k]
+            a += d1 * d1
+            b += d1 * d2
+            c += d2 * d2
+            d += d1 * w
+            e += d2 * w
+        denom = a * c - b * b
+        if denom == 0:
+            out[pair, i] = np.nan
+            continue
+        s = (b * e - c * d) / denom
+        t = (a * e - b * d) / denom
+        for k in range(3):
+            d1 = camera_mats[j1, 0, k] * x1 + camera_mats[j1, 1, k] * y1 + camera_mats[j1, 2, k]
+            d2 = camera_mats[j2, 0, k] * x2 + camera_mats[j2, 1, k] * y2 + camera_mats[j2, 2, k]
+            out[pair, i, k] = 0.5 * (centers[j1, k] + s * d1 + centers[j2, k] + t * d2)
+
+
+@njit(parallel=True, cache=True)
+def _triangulate_batch(points, camera_mats, out):
+    """Kernel of triangulate_batch: for each point, the normal matrix AᵀA of its
+    valid views is accumulated with _add_dlt_rows and solved with smallest_eigvec_sym4.
+    The points are independent, so they are solved in parallel"""
+    n_cams = points.shape[0]
+    for n in prange(points.shape[1]):
+        M = np.zeros((4, 4))
+        n_good = 0
+        for c in range(n_cams):
+            x = points[c, n, 0]
+            if np.isnan(x):
+                continue
+            _add_dlt_rows(M, x, points[c, n, 1], camera_mats[c], 1.0)
+            n_good += 1
+        if n_good < 2:
+            out[n] = np.nan
+            continue
+        p3d = smallest_eigvec_sym4(M)
+        for k in range(3):
+            out[n, k] = p3d[k] / p3d[3]
+
+
+def triangulate_batch(points, camera_mats):
+    """
+    Linear triangulation of many points at once.
+
+    Equivalent to calling triangulate_simple on every point with its valid views,
+    but solved for all points in one compiled, parallel loop: missing (NaN) views
+    are skipped, and the eigenvector of the smallest eigenvalue of each 4x4 normal
+    matrix AᵀA (the last right-singular vector of A) is found with smallest_eigvec_sym4.
+
+    Parameters
+    ----------
+    points : numpy.ndarray, shape (num_cams, N, 2)
+        The 2D coordinates for each view, NaN where a point is not seen.
+    camera_mats : numpy.ndarray, shape (num_cams, 3 or 4, 4)
+        The camera projection matrices for each view.
+
+    Returns
+    -------
+    p3ds : numpy.ndarray, shape (N, 3)
+        The reconstructed 3D points, NaN for points seen by fewer than 2 views.
+    """
+    points = np.asarray(points, dtype="float64")
+    camera_mats = np.asarray(camera_mats, dtype="float64")
+    p3ds = np.empty((points.shape[1], 3))
+    _triangulate_batch(points, camera_mats, p3ds)
+    return p3ds
+
+
+def _mean_reproj(errors):
+    """Given an CxNx2 array of reprojection errors, returns the mean error norm
+    of each point over the cameras that see it, NaN for points seen by fewer than 2"""
+    errors_norm = np.linalg.norm(errors, axis=2)
+    good = ~np.isnan(errors_norm)
+    errors_norm[~good] = 0
+    denom = np.sum(good, axis=0).astype("float64")
+    denom[denom < 1.5] = np.nan
+    return np.sum(errors_norm, axis=0) / denom
+
+
 def get_error_dict(errors_full, min_points=10):
     n_cams = errors_full.shape[0]
     errors_norm = np.linalg.norm(errors_full, axis=2)
@@ -93,18 +273,31 @@ def get_error_dict(errors_full, min_points=10):
 
     error_dict = dict()
 
-    for i in range(n_cams):
-        for j in range(i + 1, n_cams):
-            subset = good[i] & good[j]
-            err_subset = errors_norm[:, subset][[i, j]]
-            err_subset_mean = np.mean(err_subset, axis=0)
-            if np.sum(subset) > min_points:
-                percents = np.percentile(err_subset_mean, [15, 75])
-                # percents = np.percentile(err_subset, [25, 75])
-                error_dict[(i, j)] = (err_subset.shape[1], percents)
+    # all camera pairs at once, shape (n_pairs, n_points)
+    ii, jj = np.triu_indices(n_cams, 1)
+    pair_good = good[ii] & good[jj]
+    pair_counts = np.sum(pair_good, axis=1)
+    keep = np.flatnonzero(pair_counts > min_points)
+    if len(keep) == 0:
+        return error_dict
+
+    # NaN exactly where either camera misses the point, so the percentiles of
+    # all kept pairs come from one call over their valid points
+    pair_mean_err = 0.5 * (errors_norm[ii[keep]] + errors_norm[jj[keep]])
+    percents = np.nanpercentile(pair_mean_err, [15, 75], axis=1).T
+
+    for p, k in enumerate(keep):
+        error_dict[(int(ii[k]), int(jj[k]))] = (int(pair_counts[k]), percents[p])
     return error_dict
 
 
+def _mu_bounds(error_dict):
+    """Largest upper and lower error percentiles over the camera pairs"""
+    max_error = max((p[-1] for _, p in error_dict.values()), default=0)
+    min_error = max((p[0] for _, p in error_dict.values()), default=0)
+    return max_error, min_error
+
+
 def check_errors(cgroup, imgp):
     p3ds = cgroup.triangulate(imgp)
     errors_full = cgroup.reprojection_error(p3ds, imgp, mean=False)
@@ -135,7 +328,15 @@ def resample_points_extra(imgp, extra, n_samp=25):
     for idnum in range(n_ids):
         cam_counts[idnum] = np.sum(good[:, ids == idnum], axis=1)
     cam_counts_random = cam_counts + np.random.random(size=cam_counts.shape)
-    best_boards = np.argsort(-cam_counts_random, axis=0)
+
+    # each board visited below adds at least one point to the camera total,
+    # so at most n_samp of the best boards per camera are ever used
+    n_best = min(n_samp, n_ids)
+    best_boards = np.argpartition(-cam_counts_random, n_best - 1, axis=0)[:n_best]
+    best_counts = np.take_along_axis(cam_counts_random, best_boards, axis=0)
+    best_boards = np.take_along_axis(
+        best_boards, np.argsort(-best_counts, axis=0), axis=0
+    )
 
     cam_totals = np.zeros(n_cams, dtype="int64")
 
@@ -168,17 +369,22 @@ def resample_points(imgp, extra=None, n_samp=25):
 
     include = set()
 
-    for i in range(n_cams):
-        for j in range(i + 1, n_cams):
-            subset = good[i] & good[j]
-            n_good = np.sum(subset)
-            if n_good > 0:
-                ## pick points, prioritizing points seen by more cameras
-                arr = np.copy(num_cams[subset]).astype("float64")
-                arr += np.random.random(size=arr.shape)
-                picked_ix = np.argsort(-arr)[:n_samp]
-                picked = ixs[subset][picked_ix]
-                include.update(picked)
+    # all camera pairs at once, shape (n_pairs, n_points)
+    ii, jj = np.triu_indices(n_cams, 1)
+    pair_good = good[ii] & good[jj]
+
+    for subset in pair_good:
+        n_good = np.sum(subset)
+        if n_good > 0:
+            ## pick points, prioritizing points seen by more cameras
+            arr = num_cams[subset] + np.random.random(size=n_good)
+            if n_good > n_samp:
+                # only the top n_samp are needed, their order does not matter
+                picked_ix = np.argpartition(-arr, n_samp - 1)[:n_samp]
+            else:
+                picked_ix = np.arange(n_good)
+            picked = ixs[subset][picked_ix]
+            include.update(picked)
 
     final_ixs = sorted(include)
     newp = imgp[:, final_ixs]
@@ -187,10 +393,24 @@ def resample_points(imgp, extra=None, n_samp=25):
 
 
 def medfilt_data(values, size=15):
-    padsize = size + 5
-    vpad = np.pad(values, (padsize, padsize), mode="reflect")
-    vpadf = signal.medfilt(vpad, kernel_size=size)
-    return vpadf[padsize:-padsize]
+    half = size // 2
+    if len(values) <= half:
+        # ndimage mirrors the edges only once, so a window reaching past the other end
+        # differs from np.pad(mode="reflect"), which keeps reflecting. Such short
+        # series take the median of each window of the padded values instead
+        vpad = np.pad(values, (half, half), mode="reflect")
+        return np.median(sliding_window_view(vpad, size), axis=-1)
+    # ndimage's "mirror" extends the edges like np.pad(mode="reflect")
+    return median_filter(values, size=size, mode="mirror")
+
+
+def medfilt_data_batched(values, size=15):
+    """Like medfilt_data applied to every series along the first axis of values
+    (e.g. time for a TxJx3 array of points), in one call"""
+    if len(values) <= size // 2:
+        # too short for a single mirror extension, see medfilt_data
+        return np.apply_along_axis(medfilt_data, 0, values, size=size)
+    return median_filter(values, size=(size,) + (1,) * (values.ndim - 1), mode="mirror")
 
 
 def nan_helper(y):
@@ -198,40 +418,243 @@ def nan_helper(y):
 
 
 def interpolate_data(vals):
-    nans, ix = nan_helper(vals)
-    out = np.copy(vals)
-    try:
-        out[nans] = np.interp(ix(nans), ix(~nans), vals[~nans])
-    except ValueError:
-        out[:] = 0
+    nans = np.isnan(vals)
+    if not nans.any():
+        return vals
+    good = ~nans
+    if not good.any():
+        return np.zeros_like(vals)
+    out = vals.copy()
+    out[nans] = np.interp(np.flatnonzero(nans), np.flatnonzero(good), vals[good])
+    return out
+
+
+def interpolate_data_batched(vals):
+    """Like interpolate_data applied to every series along the first axis of vals,
+    but filling all series at once from the nearest valid samples before and after"""
+    nans = np.isnan(vals)
+    if not nans.any():
+        return vals
+    n = vals.shape[0]
+    ix = np.arange(n).reshape((n,) + (1,) * (vals.ndim - 1))
+
+    # index of the last valid sample at or before, and first valid at or after each sample
+    prev = np.maximum.accumulate(np.where(nans, -1, ix), axis=0)
+    after = np.flip(np.minimum.accumulate(np.flip(np.where(nans, n, ix), 0), axis=0), 0)
+    # like np.interp, hold the first and last valid values at the edges
+    prev = np.where(prev < 0, after, prev)
+    after = np.where(after >= n, prev, after)
+
+    # all-NaN series have no valid samples at all, these are filled with zeros
+    empty = prev >= n
+    prev[empty] = 0
+    after[empty] = 0
+
+    v_prev = np.take_along_axis(vals, prev, axis=0)
+    v_after = np.take_along_axis(vals, after, axis=0)
+    span = np.where(after > prev, after - prev, 1)
+    out = (v_after - v_prev) / span * (ix - prev) + v_prev
+    out[~nans] = vals[~nans]
+    out[empty] = 0
     return out
 
 
 def remap_ids(ids):
-    unique_ids = np.unique(ids)
-    ids_out = np.copy(ids)
-    for i, num in enumerate(unique_ids):
-        ids_out[ids == num] = i
-    return ids_out
+    _, ids_out = np.unique(ids, return_inverse=True)
+    return ids_out.reshape(np.shape(ids))
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _rodrigues_transform(points, rvecs, tvecs, out):
+    """Rotate each point by its rotation vector with Rodrigues' formula and translate,
+    computing every output row in a single pass without temporary arrays"""
+    for i in prange(points.shape[0]):
+        px, py, pz = points[i, 0], points[i, 1], points[i, 2]
+        rx, ry, rz = rvecs[i, 0], rvecs[i, 1], rvecs[i, 2]
+        theta = np.sqrt(rx * rx + ry * ry + rz * rz)
+        if theta == 0:
+            out[i, 0] = px + tvecs[i, 0]
+            out[i, 1] = py + tvecs[i, 1]
+            out[i, 2] = pz + tvecs[i, 2]
+            continue
+        vx, vy, vz = rx / theta, ry / theta, rz / theta
+        cos_theta = np.cos(theta)
+        sin_theta = np.sin(theta)
+        k = (vx * px + vy * py + vz * pz) * (1 - cos_theta)
+        out[i, 0] = (
+            cos_theta * px + sin_theta * (vy * pz - vz * py) + k * vx + tvecs[i, 0]
+        )
+        out[i, 1] = (
+            cos_theta * py + sin_theta * (vz * px - vx * pz) + k * vy + tvecs[i, 1]
+        )
+        out[i, 2] = (
+            cos_theta * pz + sin_theta * (vx * py - vy * px) + k * vz + tvecs[i, 2]
+        )
 
 
 def transform_points(points, rvecs, tvecs):
     """Rotate points by given rotation vectors and translate.
     Rodrigues' rotation formula is used.
     """
-    theta = np.linalg.norm(rvecs, axis=1)[:, np.newaxis]
-    with np.errstate(invalid="ignore"):
-        v = rvecs / theta
-        v = np.nan_to_num(v)
-    dot = np.sum(points * v, axis=1)[:, np.newaxis]
-    cos_theta = np.cos(theta)
-    sin_theta = np.sin(theta)
-
-    rotated = (
-        cos_theta * points + sin_theta * np.cross(v, points) + dot * (1 - cos_theta) * v
-    )
+    points = np.asarray(points, dtype="float64")
+    rvecs = np.broadcast_to(np.asarray(rvecs, dtype="float64"), points.shape)
+    tvecs = np.broadcast_to(np.asarray(tvecs, dtype="float64"), points.shape)
+    out = np.empty_like(points)
+    _rodrigues_transform(points, rvecs, tvecs, out)
+    return out
+
 
-    return rotated + tvecs
+@njit(cache=True)
+def _project_pinhole_point(px, py, pz, R, t, K, dist):
+    """Project one 3D point into a pinhole camera with the 5 coefficient
+    (k1, k2, p1, p2, k3) distortion model of cv2.projectPoints, returns (u, v)"""
+    X = R[0, 0] * px + R[0, 1] * py + R[0, 2] * pz + t[0]
+    Y = R[1, 0] * px + R[1, 1] * py + R[1, 2] * pz + t[1]
+    Z = R[2, 0] * px + R[2, 1] * py + R[2, 2] * pz + t[2]
+    # same convention as opencv for points on the camera plane
+    if Z != 0:
+        Z = 1.0 / Z
+    else:
+        Z = 1.0
+    x = X * Z
+    y = Y * Z
+
+    k1, k2, p1, p2, k3 = dist[0], dist[1], dist[2], dist[3], dist[4]
+    r2 = x * x + y * y
+    radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+    a1 = 2 * x * y
+    xd = x * radial + p1 * a1 + p2 * (r2 + 2 * x * x)
+    yd = y * radial + p1 * (r2 + 2 * y * y) + p2 * a1
+
+    # like opencv, only the focal lengths and principal point are used
+    return K[0, 0] * xd + K[0, 2], K[1, 1] * yd + K[1, 2]
+
+
+@njit(parallel=True, cache=True)
+def _project_pinhole_batch(points, R_stack, t_stack, K_stack, dist_stack, out):
+    """Project Nx3 points into every pinhole camera with the 5 coefficient
+    (k1, k2, p1, p2, k3) distortion model of cv2.projectPoints, writing CxNx2 to out"""
+    n_cams = R_stack.shape[0]
+    n_points = points.shape[0]
+    for ix in prange(n_cams * n_points):
+        c = ix // n_points
+        i = ix % n_points
+        out[c, i, 0], out[c, i, 1] = _project_pinhole_point(
+            points[i, 0],
+            points[i, 1],
+            points[i, 2],
+            R_stack[c],
+            t_stack[c],
+            K_stack[c],
+            dist_stack[c],
+        )
+
+
+@njit(parallel=True, cache=True)
+def _weighted_residuals_pinhole(
+    points, R_stack, t_stack, K_stack, dist_stack, observed, weights, mask, starts, cams, out
+):
+    """Weighted reprojection residuals w * (observed - projected) of the valid
+    (mask) measurements of CxN observations, projected like _project_pinhole_batch,
+    for the cameras listed in cams only.
+    The residuals of camera c start at measurement starts[c] of out, NaN weights count as 0"""
+    n_points = points.shape[0]
+    for ci in prange(cams.shape[0]):
+        c = cams[ci]
+        j = starts[c]
+        for i in range(n_points):
+            if not mask[c, i]:
+                continue
+            u, v = _project_pinhole_point(
+                points[i, 0],
+                points[i, 1],
+                points[i, 2],
+                R_stack[c],
+                t_stack[c],
+                K_stack[c],
+                dist_stack[c],
+            )
+            w = weights[c, i]
+            if np.isnan(w):
+                w = 0.0
+            out[2 * j] = w * (observed[c, i, 0] - u)
+            out[2 * j + 1] = w * (observed[c, i, 1] - v)
+            j += 1
+
+
+@njit(cache=True)
+def _soft_l1_abs(errors, threshold, out):
+    """soft_l1 loss of the absolute errors, in one pass over the array"""
+    for i in range(errors.shape[0]):
+        out[i] = threshold * 2 * (np.sqrt(1 + np.abs(errors[i]) / threshold) - 1)
+
+
+@njit(cache=True)
+def _huber_abs(errors, threshold, out):
+    """huber loss of the absolute errors, in one pass over the array"""
+    for i in range(errors.shape[0]):
+        e = np.abs(errors[i])
+        if e > threshold:
+            e = threshold * (2 * np.sqrt(e / threshold) - 1)
+        out[i] = e
+
+
+def _constraint_lengths(p3ds, constraints):
+    """Given an NxJx3 array of 3D points and a Kx2 array of joint pairs,
+    returns the KxN array of distances between the joints of each pair"""
+    constraints = np.asarray(constraints, dtype="int64").reshape(-1, 2)
+    diffs = p3ds[:, constraints[:, 0]] - p3ds[:, constraints[:, 1]]
+    return np.sqrt(np.einsum("nkd,nkd->kn", diffs, diffs))
+
+
+def _sparsity_pattern(rows, cols, shape):
+    """Jacobian sparsity pattern for least_squares: a uint8 CSR matrix with a 1 at
+    every (row, col) pair, counting repeated pairs once, with int32 indices when they fit"""
+    index_dtype = np.int32 if max(shape) < np.iinfo(np.int32).max else np.int64
+    rows = np.asarray(rows, dtype=index_dtype)
+    cols = np.asarray(cols, dtype=index_dtype)
+    # the values are never read as such, a zero-strided view of a single 1 is enough
+    # for the conversion, which writes the data of the CSR matrix into a new array
+    data = np.broadcast_to(np.ones(1, dtype=np.uint8), (len(rows),))
+    A = csr_matrix((data, (rows, cols)), shape=shape)
+    A.sum_duplicates()
+    A.data[:] = 1
+    return A
+
+
+@njit(parallel=True, cache=True)
+def _fill_reprojection_pattern(cams, points, n_cam_params, n_cam_total, indices):
+    """CSR column indices of the reprojection sparsity of make_jac_sparsity: the 2 rows
+    of measurement m (camera cams[m], point points[m]) both depend on the camera's
+    n_cam_params columns followed by the point's 3 columns. Each measurement fills its
+    own disjoint block of indices, so the measurements are filled in parallel"""
+    width = n_cam_params + 3
+    for m in prange(cams.shape[0]):
+        base = m * 2 * width
+        cam_start = cams[m] * n_cam_params
+        pt_start = n_cam_total + points[m] * 3
+        for r in range(2):
+            ix = base + r * width
+            for j in range(n_cam_params):
+                indices[ix + j] = cam_start + j
+            for j in range(3):
+                indices[ix + n_cam_params + j] = pt_start + j
+
+
+# frame offsets of the points in each temporal smoothness difference
+_SMOOTHNESS_STENCILS = {
+    "first": np.array([0, 1]),  # p[t+1] - p[t]
+    "second": np.array([0, 1, 2]),  # p[t+2] - 2p[t+1] + p[t]
+}
+
+
+# projections of at least this many points are spread over threads, one per camera
+_THREADED_MIN_POINTS = 10000
+
+
+# every change to a camera's parameters takes a new number from this counter,
+# so camera groups can tell whether their stacked arrays are stale
+_param_versions = itertools.count()
 
 
 class Camera:
@@ -252,6 +675,7 @@ class Camera:
         self.set_translation(tvec)
         self.set_name(name)
         self.extra_dist = extra_dist
+        self._check_params()
 
     def get_dict(self):
         return {
@@ -282,14 +706,50 @@ class Camera:
     def get_distortions(self):
         return self.dist
 
+    # the parameters are properties, so assigning them directly (cam.rvec = ...)
+    # is converted and tracked the same way as the set_* methods
+    @property
+    def matrix(self):
+        return self._matrix
+
+    @matrix.setter
+    def matrix(self, matrix):
+        self.set_camera_matrix(matrix)
+
+    @property
+    def dist(self):
+        return self._dist
+
+    @dist.setter
+    def dist(self, dist):
+        self.set_distortions(dist)
+
+    @property
+    def rvec(self):
+        return self._rvec
+
+    @rvec.setter
+    def rvec(self, rvec):
+        self.set_rotation(rvec)
+
+    @property
+    def tvec(self):
+        return self._tvec
+
+    @tvec.setter
+    def tvec(self, tvec):
+        self.set_translation(tvec)
+
     def set_camera_matrix(self, matrix):
-        self.matrix = np.array(matrix, dtype="float64")
+        self._matrix = np.array(matrix, dtype="float64")
+        self._mark_dirty()
 
     def set_focal_length(self, fx, fy=None):
         if fy is None:
             fy = fx
         self.matrix[0, 0] = fx
         self.matrix[1, 1] = fy
+        self._mark_dirty()
 
     def get_focal_length(self, both=False):
         fx = self.matrix[0, 0]
@@ -306,25 +766,85 @@ class Camera:
         return self.matrix[0, 1]
 
     def set_distortions(self, dist):
-        self.dist = np.array(dist, dtype="float64").ravel()
+        self._dist = np.array(dist, dtype="float64").ravel()
+        self._mark_dirty()
 
     def zero_distortions(self):
-        self.dist = self.dist * 0
+        self.set_distortions(self.dist * 0)
 
     def set_rotation(self, rvec):
-        self.rvec = np.array(rvec, dtype="float64").ravel()
+        self._rvec = np.array(rvec, dtype="float64").ravel()
+        self._mark_dirty()
 
     def get_rotation(self):
+        """the camera's own rvec array; editing it in place updates the camera"""
         return self.rvec
 
     def set_translation(self, tvec):
-        self.tvec = np.array(tvec, dtype="float64").ravel()
+        self._tvec = np.array(tvec, dtype="float64").ravel()
+        self._mark_dirty()
+
+    def _check_params(self):
+        """the parameters are passed to OpenCV as they are, so they must be float64 and contiguous"""
+        params = [("matrix", self.matrix), ("dist", self.dist),
+                  ("rvec", self.rvec), ("tvec", self.tvec)]
+        for name, param in params:
+            if param.dtype != np.float64 or not param.flags["C_CONTIGUOUS"]:
+                raise ValueError(
+                    "camera parameter {} must be a C-contiguous float64 array, "
+                    "got dtype {}".format(name, param.dtype))
+
+    def _mark_dirty(self):
+        """mark the parameters as changed, so the cached values are recomputed on next use"""
+        self._param_bytes = None
+
+    def _refresh(self):
+        """Recompute the values cached from the parameters (rotation matrix, extrinsics
+        matrix and version number), if the parameters changed since. Comparing their
+        bytes also catches in-place edits of the arrays, e.g. cam.get_rotation()[0] = 1,
+        which no setter sees"""
+        key = (
+            self._rvec.tobytes(),
+            self._tvec.tobytes(),
+            self._matrix.tobytes(),
+            self._dist.tobytes(),
+        )
+        if key != self._param_bytes:
+            self._param_bytes = key
+            # keep the rotation matrix, so projecting does not convert rvec every call
+            self._R_cached, _ = cv2.Rodrigues(self._rvec)
+            self._M = None
+            self._version_cached = next(_param_versions)
+
+    @property
+    def _R(self):
+        """3x3 rotation matrix of rvec"""
+        self._refresh()
+        return self._R_cached
+
+    @property
+    def _version(self):
+        """number that changes whenever the parameters change, so that camera groups
+        can tell whether their stacked arrays are stale"""
+        self._refresh()
+        return self._version_cached
 
     def get_translation(self):
+        """the camera's own tvec array; editing it in place updates the camera"""
         return self.tvec
 
     def get_extrinsics_mat(self):
-        return make_M(self.rvec, self.tvec)
+        """4x4 extrinsics matrix, built from the cached rotation matrix once per change
+        of the parameters. It is shared between calls, so it is returned read-only."""
+        self._refresh()
+        if self._M is None:
+            M = np.zeros((4, 4))
+            M[:3, :3] = self._R
+            M[:3, 3] = self.tvec
+            M[3, 3] = 1
+            M.flags.writeable = False
+            self._M = M
+        return self._M
 
     def get_name(self):
         return self.name
@@ -412,8 +932,8 @@ class Camera:
         If optimize_intrinsics=False, parse the first 6 as extrinsics.
         If True, parse extrinsics(6) + intr+dist(10) = 16.
         """
-        self.rvec = params[:3].copy()
-        self.tvec = params[3:6].copy()
+        self.set_rotation(params[:3])
+        self.set_translation(params[3:6])
 
         if not optimize_intrinsics:
             return
@@ -427,14 +947,14 @@ class Camera:
         k1, k2, p1, p2, k3 = params[11:16]
 
         # Rebuild self.matrix
-        self.matrix = np.array([
+        self.set_camera_matrix([
             [fx,   skew, cx],
             [0.0,   fy,  cy],
             [0.0, 0.0,  1.0]
-        ], dtype=np.float64)
+        ])
 
         # Update distortion
-        self.dist = np.array([k1, k2, p1, p2, k3], dtype=np.float64)
+        self.set_distortions([k1, k2, p1, p2, k3])
 
     def distort_points(self, points):
         shape = points.shape
@@ -444,17 +964,15 @@ class Camera:
             new_points,
             np.zeros(3),
             np.zeros(3),
-            self.matrix.astype("float64"),
-            self.dist.astype("float64"),
+            self.matrix,
+            self.dist,
         )
         return out.reshape(shape)
 
     def undistort_points(self, points):
         shape = points.shape
         points = points.reshape(-1, 1, 2)
-        out = cv2.undistortPoints(
-            points, self.matrix.astype("float64"), self.dist.astype("float64")
-        )
+        out = cv2.undistortPoints(points, self.matrix, self.dist)
         return out.reshape(shape)
 
     def project_old(self, points):
@@ -463,8 +981,8 @@ class Camera:
             points,
             self.rvec,
             self.tvec,
-            self.matrix.astype("float64"),
-            self.dist.astype("float64"),
+            self.matrix,
+            self.dist,
         )
         return out
     
@@ -478,16 +996,71 @@ class Camera:
             points_3d = points_3d.reshape(-1, 1, 3)
 
         # Use OpenCV to project with current intrinsics/distortion.
-        # Note: we must convert rvec/tvec to float64, same for self.matrix and self.dist.
+        # The setters already store rvec/tvec, self.matrix and self.dist as float64.
         proj_2d, _ = cv2.projectPoints(
             points_3d,
-            self.rvec.astype(np.float64),
-            self.tvec.astype(np.float64),
-            self.matrix.astype(np.float64),
-            self.dist.astype(np.float64),
+            self.rvec,
+            self.tvec,
+            self.matrix,
+            self.dist,
         )
         return proj_2d.reshape(-1, 2)
 
+    def project_cached(self, points_3d):
+        """
+        Projects Nx3 points with the cached rotation matrix instead of cv2.projectPoints.
+        Supports distortion vectors of up to 5 coefficients (k1, k2, p1, p2, k3).
+        Returns shape (N, 2).
+        """
+        points_3d = np.asarray(points_3d, dtype="float64").reshape(-1, 3)
+        Xc = points_3d @ self._R.T + self.tvec
+        z = Xc[:, 2:3]
+        # same convention as opencv for points on the camera plane
+        z = np.where(z != 0, z, 1.0)
+        x = Xc[:, 0:1] / z
+        y = Xc[:, 1:2] / z
+
+        k1, k2, p1, p2, k3 = np.pad(self.dist, (0, 5 - len(self.dist)))
+        r2 = x * x + y * y
+        radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+        a1 = 2 * x * y
+        xd = x * radial + p1 * a1 + p2 * (r2 + 2 * x * x)
+        yd = y * radial + p1 * (r2 + 2 * y * y) + p2 * a1
+
+        fx, fy = self.matrix[0, 0], self.matrix[1, 1]
+        cx, cy = self.matrix[0, 2], self.matrix[1, 2]
+        return np.hstack([fx * xd + cx, fy * yd + cy])
+
+    def project_jacobian(self, points_3d, optimize_intrinsics=False):
+        """
+        Derivatives of the projections of Nx3 points.
+        Returns (N, 2, P) derivatives with respect to the parameters of get_params,
+        with the same optimize_intrinsics flag, and (N, 2, 3) derivatives with respect
+        to the 3D points.
+        """
+        points_3d = np.asarray(points_3d, dtype="float64").reshape(-1, 1, 3)
+        n_points = points_3d.shape[0]
+        _, jac = cv2.projectPoints(
+            points_3d,
+            self.rvec,
+            self.tvec,
+            self.matrix,
+            self.dist,
+        )
+        # opencv orders the columns as rvec, tvec, fx fy, cx cy, distortions
+        jac = jac.reshape(n_points, 2, -1)
+        jac_points = jac[:, :, 3:6] @ self._R
+
+        if not optimize_intrinsics:
+            return jac[:, :, :6], jac_points
+
+        # skew is not used by opencv for projecting, so its derivative is 0
+        jac_params = np.zeros((n_points, 2, 16), dtype="float64")
+        jac_params[:, :, :10] = jac[:, :, :10]
+        n_dist = min(5, len(self.dist))
+        jac_params[:, :, 11 : 11 + n_dist] = jac[:, :, 10 : 10 + n_dist]
+        return jac_params, jac_points
+
     def reprojection_error(self, p3d, p2d):
         proj = self.project(p3d).reshape(p2d.shape)
         return p2d - proj
@@ -522,6 +1095,7 @@ class FisheyeCamera(Camera):
         self.set_translation(tvec)
         self.set_name(name)
         self.extra_dist = extra_dist
+        self._check_params()
 
     def from_dict(d):
         cam = FisheyeCamera()
@@ -541,8 +1115,8 @@ class FisheyeCamera(Camera):
             new_points,
             np.zeros(3),
             np.zeros(3),
-            self.matrix.astype("float64"),
-            self.dist.astype("float64"),
+            self.matrix,
+            self.dist,
         )
         return out.reshape(shape)
 
@@ -550,9 +1124,9 @@ class FisheyeCamera(Camera):
         shape = points.shape
         points = points.reshape(-1, 1, 2)
         out = cv2.fisheye.undistortPoints(
-            points.astype("float64"),
-            self.matrix.astype("float64"),
-            self.dist.astype("float64"),
+            np.asarray(points, dtype="float64"),
+            self.matrix,
+            self.dist,
         )
         return out.reshape(shape)
 
@@ -562,11 +1136,45 @@ class FisheyeCamera(Camera):
             points,
             self.rvec,
             self.tvec,
-            self.matrix.astype("float64"),
-            self.dist.astype("float64"),
+            self.matrix,
+            self.dist,
         )
         return out
 
+    def project_jacobian(self, points, only_extrinsics=False):
+        """
+        Derivatives of the projections of Nx3 points.
+        Returns (N, 2, P) derivatives with respect to the parameters of get_params,
+        with the same only_extrinsics flag, and (N, 2, 3) derivatives with respect
+        to the 3D points.
+        """
+        points = np.asarray(points, dtype="float64").reshape(-1, 1, 3)
+        n_points = points.shape[0]
+        _, jac = cv2.fisheye.projectPoints(
+            points,
+            self.rvec,
+            self.tvec,
+            self.matrix,
+            self.dist,
+        )
+        # opencv orders the columns as fx fy, cx cy, k1-k4, rvec, tvec, skew
+        jac = jac.reshape(n_points, 2, 15)
+        jac_points = jac[:, :, 11:14] @ self._R
+
+        jac_params = np.zeros(
+            (n_points, 2, len(self.get_params(only_extrinsics))), dtype="float64"
+        )
+        jac_params[:, :, 0:6] = jac[:, :, 8:14]
+        if only_extrinsics:
+            return jac_params, jac_points
+
+        # set_params sets both focal lengths to the same value
+        jac_params[:, :, 6] = jac[:, :, 0] + jac[:, :, 1]
+        jac_params[:, :, 7] = jac[:, :, 4]
+        if self.extra_dist:
+            jac_params[:, :, 8] = jac[:, :, 5]
+        return jac_params, jac_points
+
     def set_params(self, params, only_extrinsics):
         self.set_rotation(params[0:3])
         self.set_translation(params[3:6])
@@ -618,11 +1226,99 @@ class CameraGroup:
     def __init__(self, cameras, metadata={}):
         self.cameras = cameras
         self.metadata = metadata
+        self._soa_versions = None
+        self._jac_cache = None
+        self._last_cam_x = None
+
+    def _rebuild_soa(self):
+        """Stack the parameters of all cameras into contiguous arrays:
+        _K (Cx3x3), _dist (CxD, zero padded), _n_dist (C), _rvec (Cx3), _tvec (Cx3),
+        _Rt (Cx3x4 extrinsics), _R (Cx3x3) and _fisheye (C)"""
+        cams = self.cameras
+        n_cams = len(cams)
+        n_dist = max([5] + [len(cam.get_distortions()) for cam in cams])
+
+        self._K = np.array([cam.get_camera_matrix() for cam in cams]).reshape(n_cams, 3, 3)
+        self._dist = np.zeros((n_cams, n_dist), dtype="float64")
+        self._n_dist = np.zeros(n_cams, dtype="int64")
+        for cnum, cam in enumerate(cams):
+            dist = cam.get_distortions()
+            self._dist[cnum, : len(dist)] = dist
+            self._n_dist[cnum] = len(dist)
+        self._rvec = np.array([cam.get_rotation() for cam in cams]).reshape(n_cams, 3)
+        self._tvec = np.array([cam.get_translation() for cam in cams]).reshape(n_cams, 3)
+        self._Rt = np.array([cam.get_extrinsics_mat()[:3] for cam in cams]).reshape(
+            n_cams, 3, 4
+        )
+        self._R = np.array([cam._R for cam in cams]).reshape(n_cams, 3, 3)
+        self._fisheye = np.array(
+            [isinstance(cam, FisheyeCamera) for cam in cams], dtype="bool"
+        )
+        self._update_projection_groups()
+        self._soa_versions = [cam._version for cam in cams]
+
+    def _update_projection_groups(self):
+        """Split the cameras by projection model: _pinhole_cams are covered by the
+        compiled pinhole kernels (up to k3), _other_cams (fisheye or rational models)
+        go through opencv. _pinhole is set if every camera is in the first group"""
+        compiled = ~self._fisheye & (self._n_dist <= 5)
+        self._pinhole_cams = np.flatnonzero(compiled)
+        self._other_cams = np.flatnonzero(~compiled)
+        self._pinhole = bool(np.all(compiled))
+
+    def _ensure_soa(self):
+        """Restack the camera parameters if any camera changed since the last stacking"""
+        versions = [cam._version for cam in self.cameras]
+        if versions != self._soa_versions:
+            self._rebuild_soa()
+
+    def _update_soa_row(self, cnum):
+        """Restack the parameters of one camera in place, after it changed"""
+        if self._soa_versions is None:
+            return
+        cam = self.cameras[cnum]
+        dist = cam.get_distortions()
+        if len(dist) > self._dist.shape[1]:
+            # does not fit the stacked arrays, restack everything on next use
+            self._soa_versions = None
+            return
+        self._K[cnum] = cam.get_camera_matrix()
+        self._dist[cnum] = 0
+        self._dist[cnum, : len(dist)] = dist
+        self._n_dist[cnum] = len(dist)
+        self._rvec[cnum] = cam.get_rotation()
+        self._tvec[cnum] = cam.get_translation()
+        self._Rt[cnum] = cam.get_extrinsics_mat()[:3]
+        self._R[cnum] = cam._R
+        self._update_projection_groups()
+        self._soa_versions[cnum] = cam._version
+
+    def _sync_params_from(self, params, n_cam_params, only_extrinsics):
+        """Set the parameters of all cameras from the first C * n_cam_params values
+        of a bundle adjustment parameter vector, updating the stacked arrays in place"""
+        n_cams = len(self.cameras)
+        self._ensure_soa()
+        cam_params = params[: n_cams * n_cam_params].reshape(n_cams, n_cam_params)
+        for cnum, cam in enumerate(self.cameras):
+            cam.set_params(cam_params[cnum], only_extrinsics)
+            self._update_soa_row(cnum)
+
+    def _stacked_params(self):
+        """Returns the stacked (K Cx3x3, R Cx3x3, t Cx3, dist CxD) arrays of all cameras,
+        restacked only when one of the cameras changed"""
+        self._ensure_soa()
+        return self._K, self._R, self._tvec, self._dist
 
     def subset_cameras(self, indices):
         cams = [self.cameras[ix].copy() for ix in indices]
         return CameraGroup(cams, self.metadata)
 
+    def view_cameras(self, indices):
+        """Like subset_cameras, but the new group shares the Camera objects
+        instead of copying them, for read-only uses such as triangulation"""
+        cams = [self.cameras[ix] for ix in indices]
+        return CameraGroup(cams, self.metadata)
+
     def subset_cameras_names(self, names):
         cur_names = self.get_names()
         cur_names_dict = dict(zip(cur_names, range(len(cur_names))))
@@ -642,10 +1338,67 @@ class CameraGroup:
         n_points = points.shape[0]
         n_cams = len(self.cameras)
 
+        self._ensure_soa()
         out = np.empty((n_cams, n_points, 2), dtype="float64")
-        for cnum, cam in enumerate(self.cameras):
-            out[cnum] = cam.project(points).reshape(n_points, 2)
+        if self._pinhole:
+            K, R, t, dist = self._stacked_params()
+            _project_pinhole_batch(
+                np.asarray(points.reshape(n_points, 3), dtype="float64"),
+                R,
+                t,
+                K,
+                dist,
+                out,
+            )
+            return out
+
+        def project_camera(cnum):
+            out[cnum] = self._project_camera(cnum, points)
+
+        # opencv and numpy release the GIL, so large inputs are projected
+        # into the cameras concurrently. The pool only lives for this call, so no
+        # threads are left running in the caller's process (or inherited by forks)
+        n_workers = min(n_cams, os.cpu_count() or 1)
+        if n_workers > 1 and n_points >= _THREADED_MIN_POINTS:
+            with ThreadPoolExecutor(max_workers=n_workers) as pool:
+                list(pool.map(project_camera, range(n_cams)))
+        else:
+            for cnum in range(n_cams):
+                project_camera(cnum)
+
+        return out
+
+    def _project_camera(self, cnum, points):
+        """Project Nx1x3 points into camera cnum with its own model, from the
+        stacked parameters (which must be current), returns Nx2"""
+        if self._fisheye[cnum]:
+            proj, _ = cv2.fisheye.projectPoints(
+                points,
+                self._rvec[cnum],
+                self._tvec[cnum],
+                self._K[cnum],
+                self._dist[cnum, : self._n_dist[cnum]],
+            )
+        elif self._n_dist[cnum] <= 5:
+            proj = self.cameras[cnum].project_cached(points)
+        else:
+            proj, _ = cv2.projectPoints(
+                points,
+                self._rvec[cnum],
+                self._tvec[cnum],
+                self._K[cnum],
+                self._dist[cnum, : self._n_dist[cnum]],
+            )
+        return proj.reshape(-1, 2)
 
+    def undistort_points(self, points):
+        """Given an CxNx2 array of 2D points (or Cx...x2 with any number of point axes),
+        this returns the undistorted points, using one OpenCV call per camera"""
+        points = np.asarray(points, dtype="float64")
+        out = np.empty(points.shape)
+        for cnum, cam in enumerate(self.cameras):
+            # opencv needs contiguous input, this only copies if it is not already
+            out[cnum] = cam.undistort_points(np.ascontiguousarray(points[cnum]))
         return out
 
     def triangulate_weighted(
@@ -688,6 +1441,11 @@ class CameraGroup:
             "({}), but shape is {}".format(len(self.cameras), points.shape)
         )
 
+        # Coerce to float64, so the triangulation kernels only compile one specialization.
+        points = np.asarray(points, dtype="float64")
+        if weights is not None:
+            weights = np.asarray(weights, dtype="float64")
+
         one_point = False
         # If points are provided as a 2D array (C, 2) for a single point, reshape to (C, 1, 2).
         if len(points.shape) == 2:
@@ -696,12 +1454,7 @@ class CameraGroup:
 
         # Undistort points if required.
         if undistort:
-            new_points = np.empty(points.shape)
-            for cnum, cam in enumerate(self.cameras):
-                # Copy points to satisfy underlying OpenCV functions.
-                sub = np.copy(points[cnum])
-                new_points[cnum] = cam.undistort_points(sub)
-            points = new_points
+            points = self.undistort_points(points)
 
         n_cams, n_points, _ = points.shape
 
@@ -710,33 +1463,35 @@ class CameraGroup:
         out[:] = np.nan
 
         # Retrieve the camera projection (extrinsic) matrices for each camera.
-        cam_mats = np.array([cam.get_extrinsics_mat() for cam in self.cameras])
+        self._ensure_soa()
+        cam_mats = self._Rt
+
+        if weights is not None and weights.ndim not in (1, 2):
+            raise ValueError("Weights array must be either 1D or 2D.")
+
+        # Determine which observations are valid (non-NaN) for all points at once,
+        # and only visit the points seen by at least 2 cameras.
+        valid = ~np.isnan(points[:, :, 0])
+        process_ix = np.nonzero(valid.sum(axis=0) >= 2)[0]
 
         # Set up the iterator with an optional progress bar.
-        iterator = trange(n_points, ncols=70) if progress else range(n_points)
+        iterator = tqdm(process_ix, ncols=70) if progress else process_ix
 
         # Process each point.
         for ip in iterator:
-            # Get the (x,y) observations for this point across all cameras.
-            subp = points[:, ip, :]
-            # Determine which observations are valid (non-NaN).
-            good = ~np.isnan(subp[:, 0])
-            if np.sum(good) >= 2:
-                # Determine the weights for the valid observations.
-                if weights is None:
-                    # If no weights are provided, all observations have weight 1.
-                    w = np.ones(np.sum(good))
-                else:
-                    if weights.ndim == 1:
-                        # weights is a 1D array: same weights applied to all points.
-                        w = weights[good]
-                    elif weights.ndim == 2:
-                        # weights is a 2D array with shape (n_cams, n_points).
-                        w = weights[good, ip]
-                    else:
-                        raise ValueError("Weights array must be either 1D or 2D.")
-                # Triangulate the point using the weighted triangulation function.
-                out[ip] = triangulate_weighted(subp[good], cam_mats[good], w)
+            good = valid[:, ip]
+            # Determine the weights for the valid observations.
+            if weights is None:
+                # If no weights are provided, all observations have weight 1.
+                w = np.ones(np.count_nonzero(good))
+            elif weights.ndim == 1:
+                # weights is a 1D array: same weights applied to all points.
+                w = weights[good]
+            else:
+                # weights is a 2D array with shape (n_cams, n_points).
+                w = weights[good, ip]
+            # Triangulate the point using the weighted triangulation function.
+            out[ip] = triangulate_weighted(points[good, ip], cam_mats[good], w)
 
         # If only one point was provided, return a single 3D point instead of an array.
         if one_point:
@@ -744,9 +1499,18 @@ class CameraGroup:
 
         return out
 
-    def triangulate(self, points, undistort=True, progress=False, fast=False):
+    def triangulate(
+        self, points, undistort=True, progress=False, fast=False, fast_method="dlt"
+    ):
         """Given an CxNx2 array, this returns an Nx3 array of points,
-        where N is the number of points and C is the number of cameras"""
+        where N is the number of points and C is the number of cameras.
+
+        With fast=True, each camera pair is triangulated separately and the
+        per-pair estimates are combined with a median. fast_method picks how a
+        pair is triangulated: "dlt" (the default) uses cv2.triangulatePoints,
+        "midpoint" takes the midpoint of the closest approach of the two
+        back-projected rays, which is quicker but, with noise, differs from the
+        DLT estimate by up to about the triangulation error itself."""
 
         assert points.shape[0] == len(self.cameras), (
             "Invalid points shape, first dim should be equal to"
@@ -755,52 +1519,58 @@ class CameraGroup:
             )
         )
 
+        # work in float64 regardless of the input dtype
+        points = np.asarray(points, dtype="float64")
+
         one_point = False
         if len(points.shape) == 2:
             points = points.reshape(-1, 1, 2)
             one_point = True
 
         if undistort:
-            new_points = np.empty(points.shape)
-            for cnum, cam in enumerate(self.cameras):
-                # must copy in order to satisfy opencv underneath
-                sub = np.copy(points[cnum])
-                new_points[cnum] = cam.undistort_points(sub)
-            points = new_points
+            points = self.undistort_points(points)
 
         n_cams, n_points, _ = points.shape
 
-        if fast:
-            cam_Rt_mats = np.array(
-                [cam.get_extrinsics_mat()[:3] for cam in self.cameras]
-            )
+        self._ensure_soa()
 
-            p3d_allview_withnan = []
-            for j1, j2 in itertools.combinations(range(n_cams), 2):
-                pts1, pts2 = points[j1], points[j2]
-                Rt1, Rt2 = cam_Rt_mats[j1], cam_Rt_mats[j2]
-                tri = cv2.triangulatePoints(Rt1, Rt2, pts1.T, pts2.T)
-                tri = tri[:3] / tri[3]
-                p3d_allview_withnan.append(tri.T)
-            p3d_allview_withnan = np.array(p3d_allview_withnan)
+        if fast:
+            pairs = list(itertools.combinations(range(n_cams), 2))
+            p3d_allview_withnan = np.empty((len(pairs), n_points, 3))
+            if fast_method == "midpoint":
+                # two views have a closed form solution, no decomposition needed,
+                # so all the camera pairs are triangulated in one call
+                pairs = np.array(pairs, dtype="int64").reshape(-1, 2)
+                _triangulate_pairs(points, self._Rt, pairs, p3d_allview_withnan)
+            elif fast_method == "dlt":
+                cam_Rt_mats = self._Rt
+                for ix, (j1, j2) in enumerate(pairs):
+                    pts1, pts2 = points[j1], points[j2]
+                    tri = cv2.triangulatePoints(
+                        cam_Rt_mats[j1], cam_Rt_mats[j2], pts1.T, pts2.T
+                    )
+                    p3d_allview_withnan[ix] = (tri[:3] / tri[3]).T
+            else:
+                raise ValueError(
+                    "fast_method should be 'dlt' or 'midpoint', got {}".format(fast_method)
+                )
             out = np.nanmedian(p3d_allview_withnan, axis=0)
 
         else:
             out = np.empty((n_points, 3))
-            out[:] = np.nan
 
-            cam_mats = np.array([cam.get_extrinsics_mat() for cam in self.cameras])
+            cam_mats = self._Rt
 
+            # triangulate in chunks, so the progress bar can advance
+            chunk_size = 10000
             if progress:
-                iterator = trange(n_points, ncols=70)
+                iterator = trange(0, n_points, chunk_size, ncols=70)
             else:
-                iterator = range(n_points)
+                iterator = range(0, n_points, chunk_size)
 
-            for ip in iterator:
-                subp = points[:, ip, :]
-                good = ~np.isnan(subp[:, 0])
-                if np.sum(good) >= 2:
-                    out[ip] = triangulate_simple(subp[good], cam_mats[good])
+            for start in iterator:
+                end = start + chunk_size
+                out[start:end] = triangulate_batch(points[:, start:end], cam_mats)
 
         if one_point:
             out = out[0]
@@ -848,6 +1618,15 @@ class CameraGroup:
         errors = np.zeros(n_points, dtype="float64")
         points_2d = np.full((n_cams, n_points, 2), np.nan, dtype="float64")
 
+        # undistort every candidate once instead of once per combination
+        if undistort:
+            points_und = self.undistort_points(points)
+        else:
+            points_und = points
+
+        # camera groups for each combination of cameras, shared across points
+        groups = dict()
+
         if progress:
             iterator = trange(n_points, ncols=70)
         else:
@@ -868,9 +1647,12 @@ class CameraGroup:
                 xnums = [p[1] for p in picked]
 
                 pts = points[cnums, point_ix, xnums]
-                cc = self.subset_cameras(cnums)
+                key = tuple(cnums)
+                if key not in groups:
+                    groups[key] = self.view_cameras(cnums)
+                cc = groups[key]
 
-                p3d = cc.triangulate(pts, undistort=undistort)
+                p3d = cc.triangulate(points_und[cnums, point_ix, xnums], undistort=False)
                 err = cc.reprojection_error(p3d, pts, mean=True)
 
                 if err < best_error:
@@ -915,7 +1697,6 @@ class CameraGroup:
             points_ransac, undistort=undistort, min_cams=min_cams, progress=progress
         )
 
-    @jit(parallel=True, forceobj=True)
     def reprojection_error(self, p3ds, p2ds, mean=False):
         """Given an Nx3 array of 3D points and an CxNx2 array of 2D points,
         where N is the number of points and C is the number of cameras,
@@ -935,18 +1716,11 @@ class CameraGroup:
             )
         )
 
-        errors = np.empty((n_cams, n_points, 2))
-
-        for cnum, cam in enumerate(self.cameras):
-            errors[cnum] = cam.reprojection_error(p3ds, p2ds[cnum])
+        # one batched projection into all cameras
+        errors = p2ds - self.project(p3ds)
 
         if mean:
-            errors_norm = np.linalg.norm(errors, axis=2)
-            good = ~np.isnan(errors_norm)
-            errors_norm[~good] = 0
-            denom = np.sum(good, axis=0).astype("float64")
-            denom[denom < 1.5] = np.nan
-            errors = np.sum(errors_norm, axis=0) / denom
+            errors = _mean_reproj(errors)
 
         if one_point:
             if mean:
@@ -1004,15 +1778,10 @@ class CameraGroup:
             p2ds, extra = resample_points(p2ds_full, extra_full, n_samp=n_samp_full)
             p3ds = self.triangulate(p2ds)
             errors_full = self.reprojection_error(p3ds, p2ds, mean=False)
-            errors_norm = self.reprojection_error(p3ds, p2ds, mean=True)
+            errors_norm = _mean_reproj(errors_full)
 
             error_dict = get_error_dict(errors_full)
-            max_error = 0
-            min_error = 0
-            for k, v in error_dict.items():
-                num, percents = v
-                max_error = max(percents[-1], max_error)
-                min_error = max(percents[0], min_error)
+            max_error, min_error = _mu_bounds(error_dict)
             mu = max(min(max_error, mus[i]), min_error)
 
             good = errors_norm < mu
@@ -1047,17 +1816,12 @@ class CameraGroup:
         p2ds, extra = resample_points(p2ds_full, extra_full, n_samp=n_samp_full)
         p3ds = self.triangulate(p2ds)
         errors_full = self.reprojection_error(p3ds, p2ds, mean=False)
-        errors_norm = self.reprojection_error(p3ds, p2ds, mean=True)
+        errors_norm = _mean_reproj(errors_full)
         error_dict = get_error_dict(errors_full)
         if verbose:
             pprint(error_dict)
 
-        max_error = 0
-        min_error = 0
-        for k, v in error_dict.items():
-            num, percents = v
-            max_error = max(percents[-1], max_error)
-            min_error = max(percents[0], min_error)
+        max_error, min_error = _mu_bounds(error_dict)
         mu = max(max(max_error, end_mu), min_error)
 
         good = errors_norm < mu
@@ -1072,10 +1836,10 @@ class CameraGroup:
             verbose=verbose,
         )
 
-        error = self.average_error(p2ds, median=True)
-
+        # same as self.average_error(p2ds, median=True), reusing the errors
         p3ds = self.triangulate(p2ds)
         errors_full = self.reprojection_error(p3ds, p2ds, mean=False)
+        error = np.median(_mean_reproj(errors_full))
         error_dict = get_error_dict(errors_full)
         if verbose:
             pprint(error_dict)
@@ -1097,10 +1861,20 @@ class CameraGroup:
         start_params=None,
         only_extrinsics=False,
         verbose=True,
+        start_jac=None,
+        analytic_jac=False,
+        tr_solver="lsmr",
     ):
         """Given an CxNx2 array of 2D points,
         where N is the number of points and C is the number of cameras,
-        this performs bundle adjustsment to fine-tune the parameters of the cameras"""
+        this performs bundle adjustsment to fine-tune the parameters of the cameras.
+        A jacobian sparsity structure for the same points may be given as start_jac.
+        With analytic_jac=True, the jacobian is computed from the derivatives of the
+        camera models instead of being estimated by finite differences.
+        tr_solver is passed to least_squares, "exact" solves with a dense jacobian
+        and "lsmr" (the default) with a sparse one.
+        start_jac is only used by the finite difference jacobian with tr_solver="lsmr",
+        so giving it with analytic_jac=True or tr_solver="exact" raises a ValueError"""
 
         assert p2ds.shape[0] == len(self.cameras), (
             "Invalid points shape, first dim should be equal to"
@@ -1118,24 +1892,49 @@ class CameraGroup:
             x0 = start_params
             # n_cam_params = len(self.cameras[0].get_params(only_extrinsics))
 
+        if start_jac is not None and (analytic_jac or tr_solver == "exact"):
+            raise ValueError(
+                "start_jac is a sparsity structure for the finite difference jacobian, "
+                "it cannot be used with analytic_jac=True or tr_solver='exact'"
+            )
+
         error_fun = self._error_fun_bundle
 
-        jac_sparse = self._jac_sparsity_bundle(p2ds, n_cam_params, extra)
+        if analytic_jac and tr_solver == "exact":
+
+            def jac(*args):
+                return self._jac_fun_bundle(*args).toarray()
+
+            jac_sparse = None
+        elif analytic_jac:
+            jac = self._jac_fun_bundle
+            jac_sparse = None
+        elif tr_solver == "exact":
+            # the exact solver needs a dense jacobian, so no sparsity structure
+            jac = "2-point"
+            jac_sparse = None
+        elif start_jac is not None:
+            jac = "2-point"
+            jac_sparse = start_jac
+        else:
+            jac = "2-point"
+            jac_sparse = self._jac_sparsity_bundle(p2ds, n_cam_params, extra)
 
         f_scale = threshold
         opt = optimize.least_squares(
             error_fun,
             x0,
+            jac=jac,
             jac_sparsity=jac_sparse,
             f_scale=f_scale,
             x_scale="jac",
             loss=loss,
             ftol=ftol,
             method="trf",
-            tr_solver="lsmr",
+            tr_solver=tr_solver,
             verbose=2 * verbose,
             max_nfev=max_nfev,
-            args=(p2ds, n_cam_params, extra, only_extrinsics),
+            args=(p2ds, n_cam_params, extra, only_extrinsics, ~np.isnan(p2ds)),
         )
         best_params = opt.x
 
@@ -1147,24 +1946,27 @@ class CameraGroup:
         error = self.average_error(p2ds)
         return error
 
-    @jit(parallel=True, forceobj=True)
-    def _error_fun_bundle(self, params, p2ds, n_cam_params, extra, only_extrinsics):
-        """Error function for bundle adjustment"""
-        good = ~np.isnan(p2ds)
+    def _error_fun_bundle(
+        self, params, p2ds, n_cam_params, extra, only_extrinsics, good=None
+    ):
+        """Error function for bundle adjustment.
+        good, the mask of non-NaN values of p2ds, may be precomputed by the caller"""
+        if good is None:
+            good = ~np.isnan(p2ds)
         n_cams = len(self.cameras)
 
-        for i in range(n_cams):
-            cam = self.cameras[i]
-            a = i * n_cam_params
-            b = (i + 1) * n_cam_params
-            cam.set_params(params[a:b], only_extrinsics)
+        self._sync_params_from(params, n_cam_params, only_extrinsics)
 
-        n_cams = len(self.cameras)
         sub = n_cam_params * n_cams
         n3d = p2ds.shape[1] * 3
         p3ds_test = params[sub : sub + n3d].reshape(-1, 3)
         errors = self.reprojection_error(p3ds_test, p2ds)
-        errors_reproj = errors[good]
+
+        # every block of residuals is written straight into its range of the output
+        n_good_values = np.count_nonzero(good)
+        n_errors = n_good_values + (n3d if extra is not None else 0)
+        out = np.empty(n_errors)
+        np.compress(good.ravel(), errors.ravel(), out=out[:n_good_values])
 
         if extra is not None:
             ids = extra["ids_map"]
@@ -1175,26 +1977,108 @@ class CameraGroup:
             rvecs = params[a : a + n_boards * 3].reshape(-1, 3)
             tvecs = params[a + n_boards * 3 : a + n_boards * 6].reshape(-1, 3)
             expected = transform_points(objp, rvecs[ids], tvecs[ids])
-            errors_obj = 2 * (p3ds_test - expected).ravel() / min_scale
-        else:
-            errors_obj = np.array([])
+            errors_obj = out[n_good_values:]
+            np.subtract(p3ds_test.ravel(), expected.ravel(), out=errors_obj)
+            errors_obj *= 2
+            errors_obj /= min_scale
+
+        return out
+
+    def _jac_fun_bundle(
+        self, params, p2ds, n_cam_params, extra, only_extrinsics, good=None
+    ):
+        """Analytic jacobian of _error_fun_bundle, as a sparse matrix
+        with the structure of _jac_sparsity_bundle"""
+        if good is None:
+            good = ~np.isnan(p2ds)
+        n_cams, n_points, _ = p2ds.shape
+
+        self._sync_params_from(params, n_cam_params, only_extrinsics)
+
+        sub = n_cam_params * n_cams
+        n3d = n_points * 3
+        p3ds_test = params[sub : sub + n3d].reshape(-1, 3)
+
+        # row of each reprojection error, ordered like errors[good]
+        n_good_values = np.sum(good)
+        error_rows = np.full(good.shape, -1, dtype="int64")
+        error_rows[good] = np.arange(n_good_values)
 
-        return np.hstack([errors_reproj, errors_obj])
+        rows = []
+        cols = []
+        vals = []
+
+        # -- reprojection error --
+        # the errors are p2ds - projection, so their derivatives are negated
+        for cnum, cam in enumerate(self.cameras):
+            jac_params, jac_points = cam.project_jacobian(p3ds_test, only_extrinsics)
+            good_c = good[cnum]
+            point_ix, _ = np.nonzero(good_c)
+            rows_c = error_rows[cnum][good_c]
+
+            ## camera params
+            rows.append(np.repeat(rows_c, n_cam_params))
+            cols.append(np.tile(cnum * n_cam_params + np.arange(n_cam_params), len(rows_c)))
+            vals.append(-jac_params[good_c].ravel())
+
+            ## point positions
+            rows.append(np.repeat(rows_c, 3))
+            cols.append((sub + point_ix[:, None] * 3 + np.arange(3)).ravel())
+            vals.append(-jac_points[good_c].ravel())
+
+        n_errors = n_good_values
+        n_params = len(params)
+
+        # -- match for the object points--
+        if extra is not None:
+            ids = extra["ids_map"]
+            objp = extra["objp"]
+            min_scale = np.min(objp[objp > 0])
+            scale = 2 / min_scale
+            n_boards = int(np.max(ids)) + 1
+            a = sub + n3d
+            rvecs = params[a : a + n_boards * 3].reshape(-1, 3)
+
+            # derivatives of the board rotations R(rvec), dR[b, k] = dR / drvec_k
+            dR = np.array([cv2.Rodrigues(rvec)[1] for rvec in rvecs])
+            dR = dR.reshape(n_boards, 3, 3, 3)
+            # d(R @ objp) / drvec for every point, shape (n_points, 3, 3) as (point, xyz, k)
+            drot = np.einsum("pkij,pj->pik", dR[ids], objp)
+
+            point_ix = np.arange(n_points)
+            ks = np.arange(3)
+            rows_obj = n_errors + point_ix[:, None] * 3 + ks
+
+            ## point positions
+            rows.append(rows_obj.ravel())
+            cols.append((sub + point_ix[:, None] * 3 + ks).ravel())
+            vals.append(np.full(n3d, scale))
+
+            ## board translations
+            rows.append(rows_obj.ravel())
+            cols.append((a + n_boards * 3 + ids[:, None] * 3 + ks).ravel())
+            vals.append(np.full(n3d, -scale))
+
+            ## board rotations
+            rows_b, cols_b = np.broadcast_arrays(
+                rows_obj[:, :, None], (a + ids[:, None] * 3 + ks)[:, None, :]
+            )
+            rows.append(rows_b.ravel())
+            cols.append(cols_b.ravel())
+            vals.append(-scale * drot.ravel())
+
+            n_errors = n_errors + n3d
+
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        vals = np.concatenate(vals)
+        return csr_matrix((vals, (rows, cols)), shape=(n_errors, n_params))
 
     def _jac_sparsity_bundle(self, p2ds, n_cam_params, extra):
         """Given an CxNx2 array of 2D points,
         where N is the number of points and C is the number of cameras,
         compute the sparsity structure of the jacobian for bundle adjustment"""
 
-        point_indices = np.zeros(p2ds.shape, dtype="int32")
-        cam_indices = np.zeros(p2ds.shape, dtype="int32")
-
-        for i in range(p2ds.shape[1]):
-            point_indices[:, i] = i
-
-        for j in range(p2ds.shape[0]):
-            cam_indices[j] = j
-
         good = ~np.isnan(p2ds)
 
         if extra is not None:
@@ -1205,6 +2089,17 @@ class CameraGroup:
             n_boards = 0
             total_board_params = 0
 
+        # the pattern only depends on which points are seen and on the board ids,
+        # so the last one is kept and reused when those are the same
+        key = (
+            good.shape,
+            good.tobytes(),
+            n_cam_params,
+            None if extra is None else np.asarray(ids).tobytes(),
+        )
+        if self._jac_cache is not None and self._jac_cache[0] == key:
+            return self._jac_cache[1]
+
         n_cams = p2ds.shape[0]
         n_points = p2ds.shape[1]
         total_params_reproj = n_cams * n_cam_params + n_points * 3
@@ -1216,48 +2111,51 @@ class CameraGroup:
         else:
             n_errors = n_good_values
 
-        A_sparse = dok_matrix((n_errors, n_params), dtype="int16")
-
-        cam_indices_good = cam_indices[good]
-        point_indices_good = point_indices[good]
+        # the (row, col) triplets of every nonzero, one block at a time
+        cam_indices_good, point_indices_good, _ = np.nonzero(good)
 
         # -- reprojection error --
         ix = np.arange(n_good_values)
 
         ## update camera params based on point error
-        for i in range(n_cam_params):
-            A_sparse[ix, cam_indices_good * n_cam_params + i] = 1
+        rows = [np.repeat(ix, n_cam_params)]
+        cols = [
+            (cam_indices_good[:, None] * n_cam_params + np.arange(n_cam_params)).ravel()
+        ]
 
         ## update point position based on point error
-        for i in range(3):
-            A_sparse[ix, n_cams * n_cam_params + point_indices_good * 3 + i] = 1
+        rows.append(np.repeat(ix, 3))
+        cols.append(
+            (n_cams * n_cam_params + point_indices_good[:, None] * 3 + np.arange(3)).ravel()
+        )
 
         # -- match for the object points--
         if extra is not None:
             point_ix = np.arange(n_points)
+            # rows of each point's 3 residuals, shape (n_points, 3, 1)
+            rows_obj = (n_good_values + point_ix[:, None] * 3 + np.arange(3))[:, :, None]
 
             ## update all the camera parameters
             # A_sparse[n_good_values:n_good_values+n_points*3,
             #          0:n_cams*n_cam_params] = 1
 
             ## update board rotation and translation based on error from expected
-            for i in range(3):
-                for j in range(3):
-                    A_sparse[
-                        n_good_values + point_ix * 3 + i,
-                        total_params_reproj + ids * 3 + j,
-                    ] = 1
-                    A_sparse[
-                        n_good_values + point_ix * 3 + i,
-                        total_params_reproj + n_boards * 3 + ids * 3 + j,
-                    ] = 1
+            board_cols = (ids[:, None] * 3 + np.arange(3))[:, None, :]
+            for offset in [total_params_reproj, total_params_reproj + n_boards * 3]:
+                rows_b, cols_b = np.broadcast_arrays(rows_obj, offset + board_cols)
+                rows.append(rows_b.ravel())
+                cols.append(cols_b.ravel())
 
             ## update point position based on error from expected
-            for i in range(3):
-                A_sparse[
-                    n_good_values + point_ix * 3 + i,
-                    n_cams * n_cam_params + point_ix * 3 + i,
-                ] = 1
+            rows.append(rows_obj.ravel())
+            cols.append(
+                (n_cams * n_cam_params + point_ix[:, None] * 3 + np.arange(3)).ravel()
+            )
+
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        A_sparse = _sparsity_pattern(rows, cols, (n_errors, n_params))
+        self._jac_cache = (key, A_sparse)
 
         return A_sparse
 
@@ -1363,9 +2261,9 @@ class CameraGroup:
         constraints = np.array(constraints)
         constraints_weak = np.array(constraints_weak)
 
-        p3ds_intp = np.apply_along_axis(interpolate_data, 0, p3ds)
+        p3ds_intp = interpolate_data_batched(p3ds)
 
-        p3ds_med = np.apply_along_axis(medfilt_data, 0, p3ds_intp, size=7)
+        p3ds_med = medfilt_data_batched(p3ds_intp, size=7)
 
         default_smooth = 1.0 / np.mean(np.abs(np.diff(p3ds_med, axis=0)))
         scale_smooth_full = scale_smooth * default_smooth
@@ -1464,9 +2362,9 @@ class CameraGroup:
         constraints = np.array(constraints)
         constraints_weak = np.array(constraints_weak)
 
-        p3ds_intp = np.apply_along_axis(interpolate_data, 0, p3ds)
+        p3ds_intp = interpolate_data_batched(p3ds)
 
-        p3ds_med = np.apply_along_axis(medfilt_data, 0, p3ds_intp, size=7)
+        p3ds_med = medfilt_data_batched(p3ds_intp, size=7)
 
         default_smooth = 1.0 / np.mean(np.abs(np.diff(p3ds_med, axis=0)))
         scale_smooth_full = scale_smooth * default_smooth
@@ -1511,6 +2409,7 @@ class CameraGroup:
                 reproj_loss,
                 n_deriv_smooth,
             ),
+            kwargs={"bad": np.isnan(points[:, :, :, :, 0])},
         )
         params = opt2.x
 
@@ -1584,7 +2483,6 @@ class CameraGroup:
 
         return self.optim_points(points, p3ds, **kwargs)
 
-    @jit(forceobj=True, parallel=True)
     def _error_fun_triangulation(
         self,
         params,
@@ -1608,8 +2506,8 @@ class CameraGroup:
 
         # load params
         p3ds = params[:n_3d].reshape((n_frames, n_joints, 3))
-        joint_lengths = np.array(params[n_3d : n_3d + n_constraints])
-        joint_lengths_weak = np.array(params[n_3d + n_constraints :])
+        joint_lengths = params[n_3d : n_3d + n_constraints]
+        joint_lengths_weak = params[n_3d + n_constraints :]
 
         ## if fixed points, first n_fixed parameter points are ignored
         ## and replacement points are put in
@@ -1625,48 +2523,77 @@ class CameraGroup:
         if scores is not None:
             scores_flat = scores.reshape((n_cams, -1))
             errors = errors * scores_flat[:, :, None]
-        errors_reproj = errors[~np.isnan(p2ds_flat)]
+        good = ~np.isnan(p2ds_flat)
+
+        # every block of residuals is written straight into its range of the output
+        n_errors_reproj = np.count_nonzero(good)
+        n_errors_smooth = (n_frames - n_deriv_smooth) * n_joints * 3
+        n_errors_lengths = n_constraints * n_frames
+        n_errors_lengths_weak = n_constraints_weak * n_frames
+        out = np.empty(
+            n_errors_reproj + n_errors_smooth + n_errors_lengths + n_errors_lengths_weak
+        )
+        a = n_errors_reproj
+        b = a + n_errors_smooth
+        c = b + n_errors_lengths
+        errors_reproj = out[:a]
+        errors_smooth = out[a:b]
+        errors_lengths = out[b:c]
+        errors_lengths_weak = out[c:]
 
-        rp = reproj_error_threshold
-        errors_reproj = np.abs(errors_reproj)
+        np.compress(good.ravel(), errors.ravel(), out=errors_reproj)
+
+        rp = float(reproj_error_threshold)
         if reproj_loss == "huber":
-            bad = errors_reproj > rp
-            errors_reproj[bad] = rp * (2 * np.sqrt(errors_reproj[bad] / rp) - 1)
-        elif reproj_loss == "linear":
-            pass
+            _huber_abs(errors_reproj, rp, errors_reproj)
         elif reproj_loss == "soft_l1":
-            errors_reproj = rp * 2 * (np.sqrt(1 + errors_reproj / rp) - 1)
-
-        # temporal constraint
-        errors_smooth = np.diff(p3ds, n=n_deriv_smooth, axis=0).ravel() * scale_smooth
+            _soft_l1_abs(errors_reproj, rp, errors_reproj)
+        else:
+            np.abs(errors_reproj, out=errors_reproj)
+
+        # temporal constraint, with the first and second differences
+        # taken straight into the output
+        diffs = errors_smooth.reshape((n_frames - n_deriv_smooth, n_joints, 3))
+        if n_deriv_smooth == 1:
+            np.subtract(p3ds[1:], p3ds[:-1], out=diffs)
+        elif n_deriv_smooth == 2:
+            np.subtract(p3ds[2:], p3ds[1:-1], out=diffs)
+            diffs -= p3ds[1:-1]
+            diffs += p3ds[:-2]
+        else:
+            diffs[:] = np.diff(p3ds, n=n_deriv_smooth, axis=0)
+        errors_smooth *= scale_smooth
 
         # joint length constraint
-        errors_lengths = np.empty((n_constraints, n_frames), dtype="float64")
-        for cix, (a, b) in enumerate(constraints):
-            lengths = np.linalg.norm(p3ds[:, a] - p3ds[:, b], axis=1)
-            expected = joint_lengths[cix]
-            errors_lengths[cix] = 100 * (lengths - expected) / expected
-        errors_lengths = errors_lengths.ravel() * scale_length
-
-        errors_lengths_weak = np.empty((n_constraints_weak, n_frames), dtype="float64")
-        for cix, (a, b) in enumerate(constraints_weak):
-            lengths = np.linalg.norm(p3ds[:, a] - p3ds[:, b], axis=1)
-            expected = joint_lengths_weak[cix]
-            errors_lengths_weak[cix] = 100 * (lengths - expected) / expected
-        errors_lengths_weak = errors_lengths_weak.ravel() * scale_length_weak
-
-        return np.hstack(
-            [errors_reproj, errors_smooth, errors_lengths, errors_lengths_weak]
-        )
+        for cons, expected, scale, errors_cons in [
+            (constraints, joint_lengths, scale_length, errors_lengths),
+            (constraints_weak, joint_lengths_weak, scale_length_weak, errors_lengths_weak),
+        ]:
+            lengths = _constraint_lengths(p3ds, cons)
+            expected = expected[:, None]
+            lengths -= expected
+            lengths *= 100
+            lengths /= expected
+            np.multiply(lengths.ravel(), scale, out=errors_cons)
+
+        return out
 
     def _error_fun_triangulation_possible(
-        self, params, p2ds, beta=2, constraints=[], constraints_weak=[], *args
+        self,
+        params,
+        p2ds,
+        beta=2,
+        constraints=[],
+        constraints_weak=[],
+        *args,
+        bad=None
     ):
         # extract alphas from end of params
         # soft argmax for picking the appropriate points from p2ds
         # pass the points to error_fun_triangulate_possible for residuals
         # add errors to keep the alphas in check
         # return all the errors
+        # bad, the NaN mask of p2ds[..., 0], may be precomputed by the caller
 
         n_cams, n_frames, n_joints, n_possible, _ = p2ds.shape
 
@@ -1676,24 +2603,28 @@ class CameraGroup:
         n_params_norm = n_3d + n_constraints + n_constraints_weak
 
         # load params
-        bad = np.isnan(p2ds[:, :, :, :, 0])
+        if bad is None:
+            bad = np.isnan(p2ds[:, :, :, :, 0])
         all_bad = np.all(bad, axis=3)
 
         alphas = np.zeros((n_cams, n_frames, n_joints, n_possible), dtype="float64")
         alphas[~bad] = params[n_params_norm:]
-        params_rest = np.array(params[:n_params_norm])
-
-        # get normalized alphas
-        alphas_exp = np.exp(beta * alphas)
-        alphas_exp[bad] = 0
-        alphas_sum = np.sum(alphas_exp, axis=3)
+        params_rest = params[:n_params_norm]
+
+        # get normalized alphas, with a softmax over the possible points only
+        # shifted by the largest alpha so that the exponentials cannot overflow
+        alphas_scaled = np.where(bad, -np.inf, beta * alphas)
+        alphas_max = np.max(alphas_scaled, axis=3, keepdims=True)
+        alphas_max[all_bad] = 0
+        alphas_norm = np.exp(alphas_scaled - alphas_max)
+        alphas_sum = np.sum(alphas_norm, axis=3, keepdims=True)
         alphas_sum[all_bad] = 1
-        alphas_norm = alphas_exp / alphas_sum[:, :, :, None]
+        alphas_norm /= alphas_sum
 
         # extract the 2D points using soft argmax
-        p2ds_test = np.copy(p2ds)
-        p2ds_test[bad] = 0
-        p2ds_adj = np.sum(alphas_norm[:, :, :, :, None] * p2ds_test, axis=3)
+        p2ds_adj = np.einsum(
+            "cnjp,cnjpd->cnjd", alphas_norm, np.where(bad[..., None], 0.0, p2ds)
+        )
         p2ds_adj[all_bad] = np.nan
 
         errors = self._error_fun_triangulation(
@@ -1708,16 +2639,17 @@ class CameraGroup:
     def _initialize_params_triangulation(
         self, p3ds, constraints=[], constraints_weak=[]
     ):
-        joint_lengths = np.empty(len(constraints), dtype="float64")
-        joint_lengths_weak = np.empty(len(constraints_weak), dtype="float64")
-
-        for cix, (a, b) in enumerate(constraints):
-            lengths = np.linalg.norm(p3ds[:, a] - p3ds[:, b], axis=1)
-            joint_lengths[cix] = np.median(lengths)
-
-        for cix, (a, b) in enumerate(constraints_weak):
-            lengths = np.linalg.norm(p3ds[:, a] - p3ds[:, b], axis=1)
-            joint_lengths_weak[cix] = np.median(lengths)
+        # median length of every strong and weak constraint, in one pass
+        n_constraints = len(constraints)
+        all_constraints = np.vstack(
+            [
+                np.asarray(constraints, dtype="int64").reshape(-1, 2),
+                np.asarray(constraints_weak, dtype="int64").reshape(-1, 2),
+            ]
+        )
+        lengths = np.median(_constraint_lengths(p3ds, all_constraints), axis=1)
+        joint_lengths = lengths[:n_constraints]
+        joint_lengths_weak = lengths[n_constraints:]
 
         all_lengths = np.hstack([joint_lengths, joint_lengths_weak])
         med = np.median(all_lengths)
@@ -1757,9 +2689,10 @@ class CameraGroup:
 
         p2ds_flat = p2ds.reshape((n_cams, -1, 2))
 
-        point_indices = np.zeros(p2ds_flat.shape, dtype="int32")
-        for i in range(p2ds_flat.shape[1]):
-            point_indices[:, i] = i
+        # index of the 3D point of every 2D coordinate, only read through the good mask
+        point_indices = np.broadcast_to(
+            np.arange(p2ds_flat.shape[1], dtype="int32")[:, None], p2ds_flat.shape
+        )
 
         point_indices_3d = np.arange(n_frames * n_joints).reshape((n_frames, n_joints))
 
@@ -1778,60 +2711,69 @@ class CameraGroup:
 
         point_indices_good = point_indices[good]
 
-        A_sparse = dok_matrix((n_errors, n_params), dtype="int16")
+        # every error depends on 3 coordinates of a point per frame it spans,
+        # the length errors also on their own length parameter
+        nnz = (
+            n_errors_reproj * 3
+            + n_errors_smooth * (n_deriv_smooth + 1)
+            + (n_errors_lengths + n_errors_lengths_weak) * 7
+        )
+
+        # the (row, col) triplets of every nonzero, filled in block by block
+        rows = np.empty(nnz, dtype="int32")
+        cols = np.empty(nnz, dtype="int32")
+        ix = 0
+
+        def add_block(rows_block, cols_block):
+            nonlocal ix
+            rows_block, cols_block = np.broadcast_arrays(rows_block, cols_block)
+            n = rows_block.size
+            rows[ix : ix + n] = rows_block.ravel()
+            cols[ix : ix + n] = cols_block.ravel()
+            ix += n
+
+        ks = np.arange(3)
 
         # constraints for reprojection errors
         ix_reproj = np.arange(n_errors_reproj)
-        for k in range(3):
-            A_sparse[ix_reproj, point_indices_good * 3 + k] = 1
+        add_block(ix_reproj[:, None], point_indices_good[:, None] * 3 + ks)
 
         # sparse constraints for smoothness in time
+        # shape (frames, joints, n, k), each error depends on the n_deriv_smooth+1 next frames
         frames = np.arange(n_frames - n_deriv_smooth)
-        for j in range(n_joints):
-            for n in range(n_deriv_smooth + 1):
-                pa = point_indices_3d[frames, j]
-                pb = point_indices_3d[frames + n, j]
-                for k in range(3):
-                    A_sparse[n_errors_reproj + pa * 3 + k, pb * 3 + k] = 1
-
-        ## -- strong constraints --
-        # joint lengths should change with joint lengths errors
-        start = n_errors_reproj + n_errors_smooth
-        frames = np.arange(n_frames)
-        for cix, (a, b) in enumerate(constraints):
-            A_sparse[start + cix * n_frames + frames, n_3d + cix] = 1
+        pa = point_indices_3d[frames][:, :, None, None]
+        ns = np.arange(n_deriv_smooth + 1)[:, None]
+        add_block(n_errors_reproj + pa * 3 + ks, (pa + ns * n_joints) * 3 + ks)
 
-        # points should change accordingly to match joint lengths too
-        frames = np.arange(n_frames)
-        for cix, (a, b) in enumerate(constraints):
-            pa = point_indices_3d[frames, a]
-            pb = point_indices_3d[frames, b]
-            for k in range(3):
-                A_sparse[start + cix * n_frames + frames, pa * 3 + k] = 1
-                A_sparse[start + cix * n_frames + frames, pb * 3 + k] = 1
-
-        ## -- weak constraints --
-        # joint lengths should change with joint lengths errors
-        start = n_errors_reproj + n_errors_smooth + n_errors_lengths
+        # the strong constraints come first, then the weak ones
         frames = np.arange(n_frames)
-        for cix, (a, b) in enumerate(constraints_weak):
-            A_sparse[start + cix * n_frames + frames, n_3d + n_constraints + cix] = 1
+        start = n_errors_reproj + n_errors_smooth
+        start_params = n_3d
+        for cons in [constraints, constraints_weak]:
+            cons = np.asarray(cons, dtype="int64").reshape(-1, 2)
+            # error rows of every constraint and frame, shape (constraints, frames)
+            rows_cons = start + np.arange(len(cons))[:, None] * n_frames + frames
 
-        # points should change accordingly to match joint lengths too
-        frames = np.arange(n_frames)
-        for cix, (a, b) in enumerate(constraints_weak):
-            pa = point_indices_3d[frames, a]
-            pb = point_indices_3d[frames, b]
-            for k in range(3):
-                A_sparse[start + cix * n_frames + frames, pa * 3 + k] = 1
-                A_sparse[start + cix * n_frames + frames, pb * 3 + k] = 1
+            # joint lengths should change with joint lengths errors
+            add_block(rows_cons, start_params + np.arange(len(cons))[:, None])
+
+            # points should change accordingly to match joint lengths too
+            for joints in [cons[:, 0], cons[:, 1]]:
+                p = point_indices_3d[:, joints].T
+                add_block(rows_cons[:, :, None], p[:, :, None] * 3 + ks)
+
+            start += len(cons) * n_frames
+            start_params += len(cons)
+
+        # a constraint between a joint and itself adds the same entry twice,
+        # which is still a single nonzero of the pattern
+        A_sparse = _sparsity_pattern(rows, cols, (n_errors, n_params))
 
         return A_sparse
 
     def _jac_sparsity_triangulation_possible(self, p2ds_full, **kwargs):
         # initialize sparse jacobian using above function
         # extend to include alphas from parameters
-        ## TODO: this initialization is really slow for some reason
 
         n_cams, n_frames, n_joints, n_possible, _ = p2ds_full.shape
         good_full = ~np.isnan(p2ds_full[:, :, :, :, 0])
@@ -1845,44 +2787,42 @@ class CameraGroup:
 
         n_errors, n_params = A_sparse.shape
 
-        B_sparse = dok_matrix(
-            (n_errors + n_errors_alphas, n_params + n_alphas), dtype="int16"
-        )
-        for r, c in zip(*A_sparse.nonzero()):
-            B_sparse[r, c] = A_sparse[r, c]
-
         point_indices_2d = np.arange(n_cams * n_frames * n_joints).reshape(
             n_cams, n_frames, n_joints
         )
-        point_indices_2d_rep = np.repeat(point_indices_2d[:, :, :, None], 2, axis=3)
-        point_indices_2d_good = point_indices_2d_rep[~np.isnan(p2ds)]
         point_indices_good = point_indices_2d[any_good]
 
-        alpha_indices = np.zeros(
-            (n_cams, n_frames, n_joints, n_possible), dtype="int64"
+        alpha_indices = np.broadcast_to(
+            point_indices_2d[:, :, :, None], (n_cams, n_frames, n_joints, n_possible)
         )
-        for pnum in range(n_possible):
-            alpha_indices[:, :, :, pnum] = point_indices_2d
 
         alpha_indices_good = alpha_indices[good_full]
+        alpha_cols = n_params + np.arange(n_alphas)
 
         # alphas should change according to the reprojection error for each corresponding point
-        point_indices_2d_good_find = defaultdict(list)
-        for ix, p in enumerate(point_indices_2d_good):
-            point_indices_2d_good_find[p].append(ix)
-
-        for ix, alpha_index in enumerate(alpha_indices_good):
-            B_sparse[point_indices_2d_good_find[alpha_index], n_params + ix] = 1
+        # the point of every reprojection error row, sorted since the rows follow the points,
+        # so the rows of each point are one contiguous range found by binary search
+        point_indices_2d_rep = np.repeat(point_indices_2d[:, :, :, None], 2, axis=3)
+        point_indices_2d_good = point_indices_2d_rep[~np.isnan(p2ds)]
+        starts = np.searchsorted(point_indices_2d_good, alpha_indices_good, side="left")
+        ends = np.searchsorted(point_indices_2d_good, alpha_indices_good, side="right")
+        counts = ends - starts
+        offsets = np.cumsum(counts) - counts
+        rows_reproj = np.repeat(starts - offsets, counts) + np.arange(np.sum(counts))
+        cols_reproj = np.repeat(alpha_cols, counts)
 
         # alphas should change according to the alpha errors
-        point_indices_good_find = dict()
-        for ix, p in enumerate(point_indices_good):
-            point_indices_good_find[p] = ix
-
-        for ix, alpha_index in enumerate(alpha_indices_good):
-            if alpha_index in point_indices_good_find:
-                err_ix = n_errors + point_indices_good_find[alpha_index]
-                B_sparse[err_ix, n_params + ix] = 1
+        # every good alpha belongs to a point with at least one good possibility
+        alpha_error_rows = np.full(n_cams * n_frames * n_joints, -1, dtype="int64")
+        alpha_error_rows[point_indices_good] = n_errors + np.arange(n_errors_alphas)
+        rows_alphas = alpha_error_rows[alpha_indices_good]
+
+        A_coo = A_sparse.tocoo()
+        rows = np.concatenate([A_coo.row, rows_reproj, rows_alphas])
+        cols = np.concatenate([A_coo.col, cols_reproj, alpha_cols])
+        B_sparse = _sparsity_pattern(
+            rows, cols, (n_errors + n_errors_alphas, n_params + n_alphas)
+        )
 
         return B_sparse
 
@@ -1900,18 +2840,13 @@ class CameraGroup:
             cam.set_translation(tvec)
 
     def get_rotations(self):
-        rvecs = []
-        for cam in self.cameras:
-            rvec = cam.get_rotation()
-            rvecs.append(rvec)
-        return np.array(rvecs)
+        # a copy of the stacked rotations, restacked only if a camera changed
+        self._ensure_soa()
+        return self._rvec.copy()
 
     def get_translations(self):
-        tvecs = []
-        for cam in self.cameras:
-            tvec = cam.get_translation()
-            tvecs.append(tvec)
-        return np.array(tvecs)
+        self._ensure_soa()
+        return self._tvec.copy()
 
     def get_names(self):
         return [cam.get_name() for cam in self.cameras]
@@ -2131,6 +3066,31 @@ def _unpack_params(x_opt, camera_network, n_cam_params, optimize_intrinsics):
 
 
 
+def _set_camera_params(camera_network, x, n_cam_params, optimize_intrinsics):
+    """
+    Update every camera from the first C * n_cam_params values of x,
+    along with the stacked camera arrays used for batched projection.
+    """
+    cameras = camera_network.cameras
+    update_row = camera_network._update_soa_row
+    cam_x = x[: len(cameras) * n_cam_params]
+
+    # finite differences mostly perturb the 3D points, skip the update when
+    # the camera slice and the cameras themselves are unchanged since the last one
+    last = camera_network._last_cam_x
+    versions = [cam._version for cam in cameras]
+    if last is not None and last[1] == versions and np.array_equal(last[0], cam_x):
+        return
+
+    cam_params = cam_x.reshape(len(cameras), n_cam_params)
+    camera_network._ensure_soa()
+    for i, cam in enumerate(cameras):
+        cam.set_params(cam_params[i], optimize_intrinsics=optimize_intrinsics)
+        update_row(i)
+
+    camera_network._last_cam_x = (cam_x.copy(), [cam._version for cam in cameras])
+
+
 def bundle_adjust_with_weighted(
     camera_network,
     points_2d,
@@ -2193,8 +3153,11 @@ def bundle_adjust_with_weighted(
     # For convenience, store T,K in the camera_network so fun(...) can retrieve them
     camera_network._shape_3d = (T, K)
 
+    # Where the residuals of each camera start, counted once for the whole solve
+    valid_offsets = _valid_offsets(mask_valid)
+
     # Build the Jacobian sparsity pattern
-    jac_sparsity = make_jac_sparsity(points_2d, mask_valid, n_cam_params)
+    jac_sparsity = make_jac_sparsity(points_2d, mask_valid, n_cam_params, valid_offsets)
 
     # Solve
     res = optimize.least_squares(
@@ -2207,7 +3170,8 @@ def bundle_adjust_with_weighted(
         ftol=ftol,
         loss=loss,
         max_nfev=max_nfev,
-        args=(camera_network, points_2d, weights, n_cam_params, optimize_intrinsics, mask_valid), 
+        args=(camera_network, points_2d, weights, n_cam_params, optimize_intrinsics, mask_valid,
+              valid_offsets), 
         bounds=(-np.inf, np.inf),
     )
 
@@ -2217,7 +3181,6 @@ def bundle_adjust_with_weighted(
     p3d_opt[nan_mask_points_3d] = np.nan
     return p3d_opt, camera_network
 
-# @jit(forceobj=True, parallel=True)
 def fun(
     x,
     camera_network,
@@ -2225,69 +3188,105 @@ def fun(
     weights,
     n_cam_params,
     optimize_intrinsics,
-    mask_valid
+    mask_valid,
+    valid_offsets=None
 ):
     """
     Weighted reprojection residuals. Each valid 2D measurement yields 2 residuals.
+    valid_offsets, from _valid_offsets(mask_valid), may be precomputed by the caller.
     """
     
     n_cams = len(camera_network.cameras)
     T, K = camera_network._shape_3d  # or pass them in explicitly
 
     # 1) Update the camera parameters from x
-    for i, cam in enumerate(camera_network.cameras):
-        start = i * n_cam_params
-        end = (i+1) * n_cam_params
-        cam.set_params(x[start:end], optimize_intrinsics=optimize_intrinsics)
+    _set_camera_params(camera_network, x, n_cam_params, optimize_intrinsics)
 
     # 2) Extract 3D points
     offset = n_cams * n_cam_params
     p3d_size = T * K * 3
     p3d_flat = x[offset : offset + p3d_size].reshape((T*K, 3))
 
-    # 3) Build residuals
-    # shape of points_2d: (C, T, K, 2)
-    residuals = []
+    # 3) Build residuals straight into the output
+    # each valid measurement yields 2 residuals
+    if valid_offsets is None:
+        valid_offsets = _valid_offsets(mask_valid)
+    out = np.empty(2 * valid_offsets[-1], dtype=np.float64)
+    _weighted_residuals(
+        camera_network, p3d_flat, points_2d, weights, mask_valid, valid_offsets, out
+    )
+    return out
 
-    for c in range(n_cams):
-        cam = camera_network.cameras[c]
-        for t in range(T):
-            for k in range(K):
-                if not mask_valid[c, t, k]:
-                    continue
-                idx_3d = t*K + k
-                observed_2d = points_2d[c, t, k]
-
-                # Project
-                # shape = (1, 3)
-                X = p3d_flat[idx_3d].reshape(1, 3)
-                proj_2d = cam.project(X).ravel()  # shape (2,)
-
-                # Weight
-                w = 1.0
-                if weights is not None:
-                    w = weights[c, t, k]
-                    if np.isnan(w):
-                        w = 0.0
-
-                # Weighted residual
-                rx = w * (observed_2d[0] - proj_2d[0])
-                ry = w * (observed_2d[1] - proj_2d[1])
-                residuals.append(rx)
-                residuals.append(ry)
-
-    return np.array(residuals, dtype=np.float64)
-
-def make_jac_sparsity(points_2d, mask_valid, n_cam_params):
+def _valid_offsets(mask_valid):
+    """
+    Index of the first valid measurement of every camera in (C, T, K) order,
+    followed by the total number of valid measurements, as C + 1 integers.
+    The solvers count these once and pass them to every residual call.
+    """
+    C = mask_valid.shape[0]
+    counts = np.count_nonzero(mask_valid.reshape(C, -1), axis=1)
+    offsets = np.zeros(C + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+def _weighted_residuals(camera_network, p3d_flat, points_2d, weights, mask_valid,
+                        valid_offsets, out):
+    """
+    Write the weighted reprojection residuals (rx, ry) of every valid measurement
+    into out, in (C, T, K) order, with valid_offsets from _valid_offsets(mask_valid).
+    NaN weights count as 0.
+    """
+    C, T, K, _ = points_2d.shape
+    observed_2d = points_2d.reshape(C, T*K, 2)
+    mask = mask_valid.reshape(C, T*K)
+    starts = valid_offsets
+    w = np.ones((C, T*K)) if weights is None else weights.reshape(C, T*K)
+
+    # the cameras are grouped by projection model once, when their parameters are stacked
+    camera_network._ensure_soa()
+
+    # pinhole cameras: projection, weighting and masking fused in one compiled pass
+    if len(camera_network._pinhole_cams) > 0:
+        K_stack, R_stack, t_stack, dist_stack = camera_network._stacked_params()
+        _weighted_residuals_pinhole(
+            np.asarray(p3d_flat, dtype=np.float64),
+            R_stack,
+            t_stack,
+            K_stack,
+            dist_stack,
+            np.asarray(observed_2d, dtype=np.float64),
+            np.asarray(w, dtype=np.float64),
+            mask,
+            starts,
+            camera_network._pinhole_cams,
+            out,
+        )
+
+    # other models: opencv projection of the camera, then weight and mask it
+    if len(camera_network._other_cams) > 0:
+        points = p3d_flat.reshape(-1, 1, 3)
+        ends = starts[1:]
+        for c in camera_network._other_cams:
+            proj_2d = camera_network._project_camera(c, points)
+            w_c = np.where(np.isnan(w[c]), 0.0, w[c])
+            r = w_c[:, None] * (observed_2d[c] - proj_2d)
+            np.compress(mask[c], r, axis=0, out=out[2*starts[c] : 2*ends[c]].reshape(-1, 2))
+
+def make_jac_sparsity(points_2d, mask_valid, n_cam_params, valid_offsets=None):
     """
     Construct a sparse Jacobian pattern.
     For each valid measurement:
       - 2 residual rows
       - depends on n_cam_params columns for that camera
       - depends on 3 columns for that point
+    Only the shape of mask_valid (C, T, K) is used; points_2d is accepted for
+    compatibility but never read. The count of valid measurements is taken from
+    valid_offsets (see _valid_offsets) when the caller already has them.
     """
-    C, T, K, _ = points_2d.shape
-    valid_count = np.sum(mask_valid)
+    C, T, K = mask_valid.shape
+    if valid_offsets is None:
+        valid_offsets = _valid_offsets(mask_valid)
+    valid_count = int(valid_offsets[-1])
     # total rows = valid_count * 2
     n_rows = valid_count * 2
 
@@ -2299,37 +3298,32 @@ def make_jac_sparsity(points_2d, mask_valid, n_cam_params):
     n_points_total = T*K*3
     n_params = n_cam_total + n_points_total
 
-    A = dok_matrix((n_rows, n_params), dtype=np.uint8)
-
-    row_ptr = 0
-
-    for c in range(C):
-        for t in range(T):
-            for k in range(K):
-                if not mask_valid[c, t, k]:
-                    continue
-
-                # 2 residual rows
-                r1 = row_ptr
-                r2 = row_ptr + 1
-                row_ptr += 2
-
-                # camera block
-                cam_start = c*n_cam_params
-                cam_end = cam_start + n_cam_params
-                # mark columns for [cam_start : cam_end] as 1
-                for col in range(cam_start, cam_end):
-                    A[r1, col] = 1
-                    A[r2, col] = 1
-
-                # 3D block
-                p_idx = t*K + k
-                pt_start = n_cam_total + p_idx*3
-                pt_end   = pt_start + 3
-                for col in range(pt_start, pt_end):
-                    A[r1, col] = 1
-                    A[r2, col] = 1
+    # int32 indices are enough for any realistic problem and halve the index memory
+    index_dtype = np.int32 if max(n_rows, n_params) < np.iinfo(np.int32).max else np.int64
 
+    # camera and point (t*K + k) of every valid measurement, in (C, T, K) order.
+    # When every camera sees every point (common in lab setups) these are simply
+    # each camera repeated over all the points, with no need to search the mask
+    if valid_count == mask_valid.size:
+        c = np.repeat(np.arange(C, dtype=index_dtype), T*K)
+        p = np.tile(np.arange(T*K, dtype=index_dtype), C)
+    else:
+        c, p = np.nonzero(mask_valid.reshape(C, T*K))
+        c = c.astype(index_dtype)
+        p = p.astype(index_dtype)
+
+    # each measurement has 2 residual rows, depending on the
+    # n_cam_params columns of its camera and the 3 columns of its point.
+    # Every row has the same number of columns, already sorted since the camera
+    # columns come first, so the CSR arrays are written directly, without a sort
+    width = n_cam_params + 3
+    indptr = np.arange(0, (n_rows + 1) * width, width, dtype=index_dtype)
+    indices = np.empty(n_rows * width, dtype=index_dtype)
+    _fill_reprojection_pattern(c, p, n_cam_params, n_cam_total, indices)
+    # only the pattern matters, so the data is a zero-strided view of a single 1
+    data = np.broadcast_to(np.ones(1, dtype=np.uint8), (len(indices),))
+
+    A = csr_matrix((data, indices, indptr), shape=(n_rows, n_params))
     return A
 
 
@@ -2360,9 +3354,7 @@ def fix_init_points_and_weights(init_points_3d, weights=None):
 
     # Find which (T,K) have NaN in any coordinate
     # shape: (T, K)
-    nan_mask = np.isnan(init_points_3d_fixed[..., 0]) | \
-               np.isnan(init_points_3d_fixed[..., 1]) | \
-               np.isnan(init_points_3d_fixed[..., 2])
+    nan_mask = np.any(np.isnan(init_points_3d_fixed), axis=-1)
 
     # Replace NaNs in 3D with zeros
     init_points_3d_fixed[np.isnan(init_points_3d_fixed)] = 0.0
@@ -2371,13 +3363,7 @@ def fix_init_points_and_weights(init_points_3d, weights=None):
     if weights_fixed is not None:
         # weights_fixed has shape (C, T, K)
         # We want to set weights_fixed[:, t, k] = 0 for each (t,k) that was NaN
-        T, K, _ = init_points_3d.shape
-        C = weights_fixed.shape[0]
-
-        for t in range(T):
-            for k in range(K):
-                if nan_mask[t, k]:
-                    weights_fixed[:, t, k] = 0.0
+        weights_fixed[:, nan_mask] = 0.0
 
     return init_points_3d_fixed, weights_fixed
 
@@ -2448,7 +3434,11 @@ def bundle_adjust_with_smoothness(
     # 4) Store shape so the residual function can see T,K
     camera_network._shape_3d = (T, K)
 
-    # 5) Build standard reprojection sparsity
+    # 5) Where the residuals of each camera start, counted once for the whole solve
+    valid_offsets = _valid_offsets(mask_valid)
+
+    # 6) Build the reprojection + smoothness sparsity, already in the CSR format
+    # least_squares works with, so it is not converted again when solving
     jac_sparsity = make_jac_sparsity_with_smoothness(
         points_2d,
         mask_valid,
@@ -2456,12 +3446,11 @@ def bundle_adjust_with_smoothness(
         smoothness_weight,
         smoothness_derivative,
         T,
-        K
+        K,
+        valid_offsets=valid_offsets,
     )
-    # For advanced usage, you could also expand jac_sparsity to reflect smoothness terms,
-    # but for simplicity we'll skip that here.
 
-    # 6) Solve
+    # 7) Solve
     res = optimize.least_squares(
         fun=fun_with_smoothness,
         x0=x0,
@@ -2482,10 +3471,11 @@ def bundle_adjust_with_smoothness(
             mask_valid,
             smoothness_weight,
             smoothness_derivative,
+            valid_offsets,
         ),
     )
 
-    # 7) Unpack final params
+    # 8) Unpack final params
     x_opt = res.x
     p3d_opt = _unpack_params(x_opt, camera_network, n_cam_params, optimize_intrinsics)
 
@@ -2504,20 +3494,19 @@ def fun_with_smoothness(
     optimize_intrinsics,
     mask_valid,
     smoothness_weight,
-    smoothness_derivative
+    smoothness_derivative,
+    valid_offsets=None
 ):
     """
     1) Standard weighted reprojection residual.
     2) Optional temporal smoothness penalty for consecutive frames (1st or 2nd derivative).
+    valid_offsets, from _valid_offsets(mask_valid), may be precomputed by the caller.
     """
     n_cams = len(camera_network.cameras)
     T, K = camera_network._shape_3d
 
     # -- 1) Update cameras --
-    for i, cam in enumerate(camera_network.cameras):
-        start = i * n_cam_params
-        end = (i+1) * n_cam_params
-        cam.set_params(x[start:end], optimize_intrinsics=optimize_intrinsics)
+    _set_camera_params(camera_network, x, n_cam_params, optimize_intrinsics)
 
     # -- 2) Extract 3D from x --
     offset = n_cams * n_cam_params
@@ -2525,70 +3514,94 @@ def fun_with_smoothness(
     p3d_flat = x[offset : offset + p3d_size].reshape((T*K, 3))
     p3d_matrix = p3d_flat.reshape(T, K, 3)
 
-    # -- 3) Weighted reprojection residual (as in 'fun') --
-    residuals = []
-    for c in range(n_cams):
-        cam = camera_network.cameras[c]
-        for t in range(T):
-            for k in range(K):
-                if not mask_valid[c, t, k]:
-                    continue
-                idx_3d = t*K + k
-                obs_2d = points_2d[c, t, k]
-                proj_2d = cam.project(p3d_flat[idx_3d].reshape(1, 3)).ravel()
-
-                # Weighted
-                w = 1.0
-                if weights is not None:
-                    w = weights[c, t, k]
-                    if np.isnan(w):
-                        w = 0.0
-
-                rx = w * (obs_2d[0] - proj_2d[0])
-                ry = w * (obs_2d[1] - proj_2d[1])
-                residuals.append(rx)
-                residuals.append(ry)
-
-    # -- 4) Smoothness penalty if requested --
+    # -- 3) Smoothness penalty if requested --
     # skip if smoothness_weight is None or ~> 0
+    derivative = None
     if (smoothness_weight is not None) and (smoothness_weight > 1e-12):
-        sqrt_sw = np.sqrt(smoothness_weight)
-
-        if smoothness_derivative.lower() == "first":
-            # p3d_matrix[t+1,k] - p3d_matrix[t,k]
-            for t in range(T-1):
-                for k in range(K):
-                    # skip if either frame is NaN in 3D
-                    if np.any(np.isnan(p3d_matrix[t, k])) or np.any(np.isnan(p3d_matrix[t+1, k])):
-                        continue
-                    diff = p3d_matrix[t+1, k] - p3d_matrix[t, k]
-                    # Weighted by sqrt_sw
-                    residuals.append(sqrt_sw * diff[0])
-                    residuals.append(sqrt_sw * diff[1])
-                    residuals.append(sqrt_sw * diff[2])
-
-        elif smoothness_derivative.lower() == "second":
-            # p3d_matrix[t+2,k] - 2*p3d_matrix[t+1,k] + p3d_matrix[t,k]
-            for t in range(T-2):
-                for k in range(K):
-                    if (np.any(np.isnan(p3d_matrix[t, k])) or 
-                        np.any(np.isnan(p3d_matrix[t+1, k])) or
-                        np.any(np.isnan(p3d_matrix[t+2, k]))):
-                        continue
-                    accel = p3d_matrix[t+2, k] - 2*p3d_matrix[t+1, k] + p3d_matrix[t, k]
-                    residuals.append(sqrt_sw * accel[0])
-                    residuals.append(sqrt_sw * accel[1])
-                    residuals.append(sqrt_sw * accel[2])
-
-        # else: if user gave something else, ignore or raise an error
+        derivative = smoothness_derivative.lower()
+
+    # shape (T-1, K) or (T-2, K), skip if any frame of the difference is NaN in 3D
+    # (one NaN check over all points, instead of one per point and frame)
+    valid = None
+    if derivative in ("first", "second"):
+        nan_3d = np.any(np.isnan(p3d_matrix), axis=-1)
+        if derivative == "first":
+            valid = ~(nan_3d[1:] | nan_3d[:-1])
+        else:
+            valid = ~(nan_3d[2:] | nan_3d[1:-1] | nan_3d[:-2])
+    # else: if user gave something else, ignore or raise an error
+
+    # -- 4) Weighted reprojection residual (as in 'fun'), then the smoothness rows --
+    if valid_offsets is None:
+        valid_offsets = _valid_offsets(mask_valid)
+    n_res_reproj = 2 * int(valid_offsets[-1])
+    n_res_smooth = 0 if valid is None else 3 * int(np.count_nonzero(valid))
+    out = np.empty(n_res_reproj + n_res_smooth, dtype=np.float64)
+    _weighted_residuals(
+        camera_network, p3d_flat, points_2d, weights, mask_valid, valid_offsets,
+        out[:n_res_reproj]
+    )
+
+    if valid is not None:
+        smooth = out[n_res_reproj:]
+        if valid.all():
+            # no NaN points (the usual case), difference straight into the output
+            diff = smooth.reshape(valid.shape + (3,))
+            if derivative == "first":
+                # p3d_matrix[t+1,k] - p3d_matrix[t,k]
+                np.subtract(p3d_matrix[1:], p3d_matrix[:-1], out=diff)
+            else:
+                # p3d_matrix[t+2,k] - 2*p3d_matrix[t+1,k] + p3d_matrix[t,k]
+                np.multiply(p3d_matrix[1:-1], -2, out=diff)
+                diff += p3d_matrix[2:]
+                diff += p3d_matrix[:-2]
+        elif derivative == "first":
+            diff = p3d_matrix[1:] - p3d_matrix[:-1]
+            smooth[:] = diff[valid].ravel()
+        else:
+            accel = p3d_matrix[2:] - 2*p3d_matrix[1:-1] + p3d_matrix[:-2]
+            smooth[:] = accel[valid].ravel()
+        smooth *= np.sqrt(smoothness_weight)
 
     # Return the final array
-    return np.array(residuals, dtype=np.float64)
+    return out
+
+
+@lru_cache(maxsize=8)
+def _smoothness_sparsity(T, K, n_cams, n_cam_params, smoothness_derivative):
+    """
+    Sparsity of the smoothness rows of make_jac_sparsity_with_smoothness, for
+    'first' or 'second' (a key of _SMOOTHNESS_STENCILS) differences. It only
+    depends on the problem dimensions, so it is cached and reused across calls
+    with the same shapes; the returned matrix must not be modified.
+    """
+    offsets = _SMOOTHNESS_STENCILS[smoothness_derivative]
+    n_terms = len(offsets)
+    n_t = T - offsets[-1]
+    n_smooth_rows = n_t * K * 3
+
+    # The 3D block starts at 'cam_offset = C * n_cam_params'.
+    cam_offset = n_cams * n_cam_params
+    n_params = cam_offset + T * K * 3
+
+    # The derivative of keypoint k over frames t + offsets gives 3 rows (x, y, z),
+    # row x only depends on the x columns of those points, and so on.
+    # Row r = (t*K + k)*3 + axis is also the index of that coordinate at frame t,
+    # so its columns are cam_offset + r + offsets*3K: n_terms per row, already
+    # sorted, and the CSR arrays are written directly without a sort.
+    # Only the pattern matters, so the +1/-1 (or +1/-2/+1) factors are all stored as 1.
+    nnz = n_smooth_rows * n_terms
+    index_dtype = np.int32 if max(n_params, nnz) < np.iinfo(np.int32).max else np.int64
+    rows = np.arange(n_smooth_rows, dtype=index_dtype)
+    indices = (cam_offset + rows[:, None] + (offsets * 3 * K).astype(index_dtype)).ravel()
+    indptr = np.arange(0, nnz + 1, n_terms, dtype=index_dtype)
+    data = np.broadcast_to(np.ones(1, dtype=np.uint8), (nnz,))
+    return csr_matrix((data, indices, indptr), shape=(n_smooth_rows, n_params))
 
 
 def make_jac_sparsity_with_smoothness(points_2d, mask_valid, n_cam_params,
                                       smoothness_weight, smoothness_derivative,
-                                      T, K):
+                                      T, K, sparse_format="csr", valid_offsets=None):
     """
     Like make_jac_sparsity, but we add extra rows for each temporal smoothness term.
 
@@ -2599,122 +3612,37 @@ def make_jac_sparsity_with_smoothness(points_2d, mask_valid, n_cam_params,
     - 'smoothness_weight' might be None or a float
     - 'smoothness_derivative' in ['first','second']
     - T, K are the #frames, #keypoints
+    - 'sparse_format' is the scipy.sparse format of the result: 'csr' (the
+      default, which is what least_squares works with), 'csc', 'coo', 'lil',
+      'dok', 'bsr' or 'dia'
+    - 'valid_offsets' is the optional result of _valid_offsets(mask_valid),
+      passed on to make_jac_sparsity
 
     Returns
     -------
-    A dok_matrix that has (#reproj_rows + #smoothness_rows) x (#camera_params + #3D_params).
+    A sparse matrix that has (#reproj_rows + #smoothness_rows) x (#camera_params + #3D_params).
     """
     # 1) Build the standard reprojection pattern:
-    A_reproj = make_jac_sparsity(points_2d, mask_valid, n_cam_params)
+    A_reproj = make_jac_sparsity(points_2d, mask_valid, n_cam_params, valid_offsets)
     n_reproj_rows, n_params = A_reproj.shape
 
     # 2) If no smoothness, just return the standard version
     if smoothness_weight is None or smoothness_weight <= 1e-12:
-        return A_reproj
+        return A_reproj.asformat(sparse_format)
 
-    # 3) Count how many new rows we need for smoothness
-    # e.g. for 'first' derivative, we have (T-1)*K * 3 additional rows
-    if smoothness_derivative.lower() == "first":
-        n_smooth_rows = (T - 1) * K * 3
-    elif smoothness_derivative.lower() == "second":
-        n_smooth_rows = (T - 2) * K * 3
-    else:
-        # If user gave something else, skip
-        n_smooth_rows = 0
-
-    # 4) Create a bigger DOK matrix for total rows
-    A = dok_matrix((n_reproj_rows + n_smooth_rows, n_params), dtype=np.uint8)
-
-    # 5) Copy the reprojection pattern into the top
-    for (r, c), val in A_reproj.items():
-        A[r, c] = val
+    # 3) If user gave something else than 'first' or 'second', skip
+    if smoothness_derivative.lower() not in _SMOOTHNESS_STENCILS:
+        return A_reproj.asformat(sparse_format)
 
-    # 6) Now fill in the smoothness rows
-    row_ptr = n_reproj_rows  # start adding new rows after reprojection
-    sqrt_sw = np.sqrt(smoothness_weight)  # you won't actually store this, but indexing
-
-    # We'll only need to mark 3D dependencies. The camera parameters do NOT matter for smoothness 
-    # because the derivative constraints only depend on the 3D point coordinates.
-    # So we do not set anything for columns in [0 : n_cams * n_cam_params].
-    # The 3D block starts at 'cam_offset = C * n_cam_params'.
-
-    # If you keep T,K in the camera group, you might not need them as function args.
-    # We'll just assume T,K are known here.
-    # index for 3D block
-    # The total # 3D points = T*K, each has 3 coords => T*K*3
-    n_cams = points_2d.shape[0]
-    cam_offset = n_cams * n_cam_params
+    # 4) Smoothness rows only depend on the 3D point coordinates, never on the
+    # camera parameters or on which points were observed,
+    # e.g. for 'first' derivative, we have (T-1)*K * 3 additional rows
+    n_cams = mask_valid.shape[0]
+    A_smooth = _smoothness_sparsity(
+        int(T), int(K), n_cams, n_cam_params, smoothness_derivative.lower()
+    )
 
-    # We'll do "first" derivative as an example:
-    if smoothness_derivative.lower() == "first":
-        for t in range(T-1):
-            for k in range(K):
-                # The row depends on p3d_matrix[t+1, k] and p3d_matrix[t, k].
-                # That's 2 sets of x,y,z => 6 parameter columns total.
-                # Each difference is 3 residuals (x,y,z).
-                # We add 3 new rows in the matrix for them.
-
-                # row for x, y, z
-                # row_x = row_ptr
-                # row_y = row_ptr + 1
-                # row_z = row_ptr + 2
-                # but we only need to mark columns with 1, not the smoothness_weight
-
-                # 3D index => p_idx = t*K + k
-                p_idxA = t*K + k
-                p_idxB = (t+1)*K + k
-
-                # The columns for p_idxA: (cam_offset + p_idxA*3) to (cam_offset + p_idxA*3 + 2)
-                colA = cam_offset + p_idxA*3
-                colB = cam_offset + p_idxB*3
-
-                # Now set A[row_x, colA + 0] = 1 => dx/dx
-                # But the difference is: p[t+1] - p[t].
-                # That means the partial derivative w.r.t. each coordinate is +1 for p[t+1], -1 for p[t].
-                # So we might store a +1 and -1. But since this code uses a binary pattern (1 = potentially non-zero),
-                # it might suffice to set them to 1 or 2. Because the solver only wants to know "non-zero or zero?" 
-                # There's no way to store negative 1 in the DOK pattern for jac_sparsity.
-
-                # We'll just store 1 for each coordinate that is relevant, because "non-zero" is all that matters.
-                # row_x
-                A[row_ptr, colA + 0] = 1   # depends on p[t, k].x
-                A[row_ptr, colB + 0] = 1   # depends on p[t+1, k].x
-
-                # row_y
-                A[row_ptr + 1, colA + 1] = 1
-                A[row_ptr + 1, colB + 1] = 1
-
-                # row_z
-                A[row_ptr + 2, colA + 2] = 1
-                A[row_ptr + 2, colB + 2] = 1
-
-                row_ptr += 3
-
-    elif smoothness_derivative.lower() == "second":
-        # p[t+2] - 2p[t+1] + p[t], similarly each difference => 3 rows
-        for t in range(T-2):
-            for k in range(K):
-                p_idxA = t*K + k       # p[t]
-                p_idxB = (t+1)*K + k   # p[t+1]
-                p_idxC = (t+2)*K + k   # p[t+2]
-
-                colA = cam_offset + p_idxA*3
-                colB = cam_offset + p_idxB*3
-                colC = cam_offset + p_idxC*3
-
-                # row_x
-                A[row_ptr,   colA + 0] = 1
-                A[row_ptr,   colB + 0] = 1
-                A[row_ptr,   colC + 0] = 1
-                # row_y
-                A[row_ptr+1, colA + 1] = 1
-                A[row_ptr+1, colB + 1] = 1
-                A[row_ptr+1, colC + 1] = 1
-                # row_z
-                A[row_ptr+2, colA + 2] = 1
-                A[row_ptr+2, colB + 2] = 1
-                A[row_ptr+2, colC + 2] = 1
-
-                row_ptr += 3
+    # 5) Stack the reprojection pattern on top of the smoothness rows
+    A = sparse_vstack([A_reproj, A_smooth], format=sparse_format)
 
     return A
\ No newline at end of file
@@ -0,0 +1,244 @@
+import numpy as np
+import pytest
+from scipy import signal
+
+from aniposelib.cameras import (
+    Camera,
+    CameraGroup,
+    FisheyeCamera,
+    interpolate_data,
+    interpolate_data_batched,
+    medfilt_data,
+    medfilt_data_batched,
+    remap_ids,
+    smallest_eigvec_sym4,
+    triangulate_batch,
+    triangulate_simple,
+)
+
+
+def make_group(n_cams=3):
+    cams = []
+    for i in range(n_cams):
+        cam = Camera(
+            matrix=[[800.0, 0, 320.0], [0, 800.0, 240.0], [0, 0, 1]],
+            dist=[0.05, -0.01, 0.001, -0.001, 0.002],
+            size=(640, 480),
+            rvec=[0.1 * i, 0.3 * i, 0.0],
+            tvec=[0.2 * i, 0.0, 10.0],
+            name=str(i),
+        )
+        cams.append(cam)
+    return CameraGroup(cams)
+
+
+def test_assign_parameters():
+    cgroup = make_group()
+    cam = cgroup.cameras[0]
+    p3d = np.array([[1.0, 1.0, 1.0]])
+    # fill the caches before changing the camera
+    cam.get_extrinsics_mat()
+    cgroup.triangulate(cgroup.project(p3d)[:, 0])
+
+    cam.rvec = np.array([0.5, 0.2, 0.3])
+    cam.tvec = np.array([0, 0, 7.0])
+
+    M = cam.get_extrinsics_mat()
+    assert np.allclose(M[:3, 3], [0, 0, 7])
+    assert np.allclose(M[:3, :3], Camera(rvec=[0.5, 0.2, 0.3]).get_extrinsics_mat()[:3, :3])
+
+    expected = Camera(
+        matrix=cam.matrix, dist=cam.dist, rvec=[0.5, 0.2, 0.3], tvec=[0, 0, 7.0]
+    ).project(p3d)
+    assert np.allclose(cam.project(p3d), expected)
+    assert np.allclose(cgroup.project(p3d)[0], expected)
+
+    p2d = cgroup.project(p3d)[:, 0]
+    assert np.allclose(cgroup.triangulate(p2d), p3d[0], atol=1e-6)
+
+
+def test_edit_parameters_in_place():
+    cgroup = make_group()
+    cam = cgroup.cameras[1]
+    p3d = np.array([[1.0, 1.0, 1.0]])
+    cgroup.triangulate(cgroup.project(p3d)[:, 0])
+
+    cam.get_rotation()[:] = [0.5, 0.2, 0.3]
+    cam.get_translation()[2] = 9.0
+    cam.get_camera_matrix()[0, 0] = 1000.0
+
+    assert np.allclose(cam._R, Camera(rvec=[0.5, 0.2, 0.3])._R)
+    K, R, t, _ = cgroup._stacked_params()
+    assert np.allclose(R[1], cam._R)
+    assert np.allclose(t[1], [0.2, 0, 9])
+    assert np.allclose(K[1, 0, 0], 1000)
+
+    p2d = cgroup.project(p3d)[:, 0]
+    assert np.allclose(cgroup.triangulate(p2d), p3d[0], atol=1e-6)
+
+
+def make_bundle_problem(fisheye):
+    rng = np.random.RandomState(0)
+    cams = []
+    for i in range(3):
+        params = dict(
+            matrix=[[800.0, 0, 320.0], [0, 800.0, 240.0], [0, 0, 1]],
+            size=(640, 480),
+            rvec=[0.1 * i, 0.3 * i, 0.05],
+            tvec=[0.2 * i, -0.1, 10.0],
+            name=str(i),
+        )
+        if fisheye:
+            cams.append(FisheyeCamera(dist=[0.01, -0.002, 0, 0], **params))
+        else:
+            cams.append(Camera(dist=[0.05, -0.01, 0.001, -0.001, 0.002], **params))
+    cgroup = CameraGroup(cams)
+
+    n_points = 24
+    p3ds = rng.randn(n_points, 3)
+    p2ds = cgroup.project(p3ds) + rng.randn(3, n_points, 2)
+    # every point stays visible in at least 2 cameras, so it can be triangulated
+    p2ds[0, rng.rand(n_points) < 0.3] = np.nan
+
+    extra = {
+        "objp": np.abs(rng.randn(n_points, 3)) + 0.1,
+        "ids": (np.arange(n_points) // 6) * 3,
+        "rvecs": 0.3 * rng.randn(3, n_points, 3),
+        "tvecs": rng.randn(3, n_points, 3),
+    }
+    extra["ids_map"] = remap_ids(extra["ids"])
+    return cgroup, p2ds, extra
+
+
+@pytest.mark.parametrize("fisheye", [False, True])
+@pytest.mark.parametrize("only_extrinsics", [False, True])
+@pytest.mark.parametrize("use_extra", [False, True])
+def test_bundle_jacobian(fisheye, only_extrinsics, use_extra):
+    cgroup, p2ds, extra = make_bundle_problem(fisheye)
+    if not use_extra:
+        extra = None
+    np.random.seed(0)
+    x0, n_cam_params = cgroup._initialize_params_bundle(p2ds, extra, only_extrinsics)
+    x0 = x0 + 0.01 * np.random.RandomState(1).randn(len(x0))
+    args = (p2ds, n_cam_params, extra, only_extrinsics)
+
+    jac = cgroup._jac_fun_bundle(x0, *args).toarray()
+
+    # central differences of the error function
+    eps = 1e-6
+    jac_fd = np.empty_like(jac)
+    for j in range(len(x0)):
+        dx = np.zeros(len(x0))
+        dx[j] = eps
+        jac_fd[:, j] = (
+            cgroup._error_fun_bundle(x0 + dx, *args)
+            - cgroup._error_fun_bundle(x0 - dx, *args)
+        ) / (2 * eps)
+
+    assert np.allclose(jac, jac_fd, rtol=1e-5, atol=1e-5)
+
+
+def test_bundle_start_jac_conflicts():
+    cgroup, p2ds, extra = make_bundle_problem(False)
+    start_jac = cgroup._jac_sparsity_bundle(p2ds, 6, None)
+    with pytest.raises(ValueError):
+        cgroup.bundle_adjust(p2ds, start_jac=start_jac, analytic_jac=True, verbose=False)
+    with pytest.raises(ValueError):
+        cgroup.bundle_adjust(p2ds, start_jac=start_jac, tr_solver="exact", verbose=False)
+
+
+def svd_triangulate(points, camera_mats):
+    """Reference linear triangulation, from the full SVD of the DLT rows"""
+    A = np.concatenate(
+        [
+            points[:, 0:1] * camera_mats[:, 2] - camera_mats[:, 0],
+            points[:, 1:2] * camera_mats[:, 2] - camera_mats[:, 1],
+        ]
+    )
+    vh = np.linalg.svd(A)[2]
+    return vh[-1, :3] / vh[-1, 3]
+
+
+@pytest.mark.parametrize("n_cams", [2, 3, 4, 5, 6])
+def test_triangulate_matches_svd(n_cams):
+    rng = np.random.RandomState(n_cams)
+    cams = [
+        Camera(rvec=0.3 * rng.randn(3), tvec=np.r_[0.5 * rng.randn(2), 10])
+        for _ in range(n_cams)
+    ]
+    camera_mats = np.array([cam.get_extrinsics_mat()[:3] for cam in cams])
+    p3ds = rng.randn(50, 3)
+    # normalized image coordinates, with a little noise so the system is not exact
+    p2ds = np.array([cam.project(p3ds) for cam in cams])
+    p2ds = np.array([cam.undistort_points(p) for cam, p in zip(cams, p2ds)])
+    p2ds += 1e-3 * rng.randn(*p2ds.shape)
+
+    expected = np.array([svd_triangulate(p2ds[:, i], camera_mats) for i in range(50)])
+    single = np.array([triangulate_simple(p2ds[:, i], camera_mats) for i in range(50)])
+    assert np.allclose(single, expected, rtol=0, atol=1e-12)
+    assert np.allclose(triangulate_batch(p2ds, camera_mats), expected, rtol=0, atol=1e-12)
+
+
+def test_smallest_eigvec_fallback():
+    # M = 0 breaks the factorization, and a rank 1 M makes it lose its last pivot
+    # to rounding, so both are solved by np.linalg.eigh
+    u = np.array([1.0, 2.0, 3.0, 4.0])
+    for M in [np.zeros((4, 4)), np.outer(u, u)]:
+        v = smallest_eigvec_sym4(M)
+        assert np.array_equal(v, np.linalg.eigh(M)[1][:, 0])
+        assert np.allclose(M @ v, 0, atol=1e-12)
+
+    # inverse iteration otherwise, which finds the smallest eigenvector up to sign
+    rng = np.random.RandomState(0)
+    Q, _ = np.linalg.qr(rng.randn(4, 4))
+    M = Q @ np.diag([1e-9, 1.0, 2.0, 5.0]) @ Q.T
+    v = smallest_eigvec_sym4(M)
+    assert np.allclose(np.abs(v @ Q[:, 0]), 1, atol=1e-12)
+
+
+def reference_medfilt(values, size):
+    """medfilt_data as originally written, padding well past the window
+    with np.pad(mode="reflect") before scipy.signal.medfilt"""
+    padsize = size + 5
+    vpad = np.pad(values, (padsize, padsize), mode="reflect")
+    return signal.medfilt(vpad, kernel_size=size)[padsize:-padsize]
+
+
+@pytest.mark.parametrize("size", [3, 7, 15])
+def test_medfilt_data(size):
+    rng = np.random.RandomState(size)
+    # include series shorter than half the window, where a single mirror is not enough
+    for n in range(1, 40):
+        values = rng.randn(n)
+        assert np.allclose(medfilt_data(values, size=size), reference_medfilt(values, size))
+
+
+@pytest.mark.parametrize("n_frames", [1, 2, 3, 4, 7, 30])
+def test_medfilt_data_batched(n_frames):
+    rng = np.random.RandomState(n_frames)
+    values = rng.randn(n_frames, 4, 3)
+    values[:, 1, 2] = np.nan
+
+    expected = np.apply_along_axis(medfilt_data, 0, values, size=7)
+    result = medfilt_data_batched(values, size=7)
+    assert np.allclose(result, expected, equal_nan=True)
+    assert np.allclose(result[:, 0, 0], reference_medfilt(values[:, 0, 0], 7))
+
+
+@pytest.mark.parametrize("n_frames", [1, 2, 3, 5, 40])
+def test_interpolate_data_batched(n_frames):
+    rng = np.random.RandomState(n_frames)
+    values = rng.randn(n_frames, 4, 3)
+    values[rng.rand(*values.shape) < 0.3] = np.nan
+    # gaps at both edges, and a series with no valid samples at all
+    values[0, 0, 0] = values[-1, 0, 0] = np.nan
+    values[:, 1, 2] = np.nan
+
+    expected = np.apply_along_axis(interpolate_data, 0, values)
+    result = interpolate_data_batched(values)
+    assert not np.any(np.isnan(result))
+    assert np.allclose(result, expected)
+    assert np.all(result[:, 1, 2] == 0)
+
+    full = rng.randn(n_frames, 2)
+    assert np.array_equal(interpolate_data_batched(full), full)